@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+# run: ./bench.py run -o bench.json && ./bench.py compare base.json bench.json
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from gbd_eval import synthetic, runtimes, scores, bootstrap, cache, curves, live, significance, schedule
+from gbd_eval.portfolio import Portfolios, pscore
+from gbd_eval.preprocess import DataPreprocessor, read_long
+from gbd_eval.runtimes import RuntimeMatrix
+from gbd_eval.scheduler import headless
+from gbd_eval.store import Store
+from gbd_eval.util import eprint
+
+
+PRESETS = {
+    "quick": [ "1000x10", "10000x50" ],
+    "full": [ "1000x10", "10000x50", "100000x100", "10000x500", "1000000x10", "1000000x50" ],
+}
+
+
+class Case:
+
+    # setup(ctx) returns the arguments of run, it is not measured;
+    # check(result, *args) raises a ValueError if the result of the first run is wrong
+    def __init__(self, name: str, run, setup=None, max_cells: int = None, max_solvers: int = None, check=None):
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda ctx : (ctx,))
+        self.max_cells = max_cells
+        self.max_solvers = max_solvers
+        self.check = check
+
+    def applies(self, n: int, m: int):
+        return (self.max_cells is None or n * m <= self.max_cells) and (self.max_solvers is None or m <= self.max_solvers)
+
+
+class Context:
+
+    # synthetic data of one size, derived inputs are created on first use
+    def __init__(self, n: int, m: int, timeout: int, seed: int, tmp: str):
+        self.n, self.m, self.timeout, self.tmp = n, m, timeout, tmp
+        self.df, self.solvers = synthetic.frame(n, m, timeout, seed=seed)
+        self.rm = RuntimeMatrix.from_frame(self.df, self.solvers, timeout)
+        self.top = self.rm.scores(vbs=False).sort_values().index[:3].tolist()
+        self._long = None
+        self._store = None
+        self._matrix = None
+        self._missing = None
+
+    def frame(self, vbs: bool = False):
+        df = self.df.copy()
+        if vbs:
+            df["vbs"] = self.rm.vbs()
+        return df
+
+    def path(self, name: str):
+        return os.path.join(self.tmp, name)
+
+    def long(self):
+        if self._long is None:
+            self._long = self.path("long.csv")
+            synthetic.long(self.df, self.solvers, self.timeout).to_csv(self._long, index=False)
+        return self._long
+
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = self.path("matrix.rtm")
+            self.rm.save(self._matrix)
+        return self._matrix
+
+    def missing(self, seed: int = 0):
+        # the matrix with 10% of the runs and 5% of the instances without results
+        if self._missing is None:
+            rng = np.random.default_rng(seed)
+            X = self.rm.data.copy()
+            X[rng.random(X.shape) < .1] = np.nan
+            X[rng.random(len(X)) < .05] = np.nan
+            self._missing = RuntimeMatrix(X, self.rm.hashes, self.solvers, self.timeout)
+        return self._missing
+
+    def store(self):
+        if self._store is None:
+            self._store = Store(self.path("store")).append(self.df, 2023, "main", self.solvers, [ "family" ], row_group_size=2**14)
+        return self._store
+
+
+def stream(board, long: pd.DataFrame, chunksize: int = 10**4):
+    for start in range(0, len(long.index), chunksize):
+        board.feed(long.iloc[start:start+chunksize])
+    return board
+
+
+def parity(exact: Portfolios, rm: RuntimeMatrix):
+    # the exact search scores a portfolio as the beam search does, and finds none worse than the beam
+    beam = Portfolios.from_matrix(rm).generate(len(exact.pfs) + 1, 10)
+    for k, (found, searched) in enumerate(zip(exact.pfs, beam.pfs), 1):
+        scores = dict(searched)
+        for tup, score in found:
+            if tup in scores and not np.isclose(score, scores[tup], rtol=1e-9):
+                raise ValueError("k={}: exact scores {} as {}, beam as {}".format(k, tup, score, scores[tup]))
+        if found[0][1] > searched[0][1] * (1 + 1e-9):
+            raise ValueError("k={}: exact best {} is worse than beam best {}".format(k, found[0][1], searched[0][1]))
+
+
+def single(slots: pd.DataFrame, ctx: Context):
+    # a schedule solves at least as many instances as the best single solver running until the timeout
+    X, timeout = schedule.runtimes(ctx.rm, ctx.solvers)
+    best = int((X <= timeout).sum(axis=0).max())
+    if slots["solved"].iloc[-1] < best:
+        raise ValueError("schedule solves {}, the best single solver {}".format(slots["solved"].iloc[-1], best))
+
+
+def cases():
+    from gbd_eval import cactus, scatter
+    return [
+        Case("runtimes.parse", lambda ctx : runtimes.parse(ctx.df, ctx.solvers)),
+        Case("RuntimeMatrix.from_frame", lambda ctx : RuntimeMatrix.from_frame(ctx.df, ctx.solvers, ctx.timeout)),
+        Case("RuntimeMatrix.save", lambda ctx : ctx.rm.save(ctx.path("matrix.rtm"))),
+        Case("RuntimeMatrix.open+scores", lambda path : scores.scores(RuntimeMatrix.open(path)), lambda ctx : (ctx.matrix(),)),
+        Case("DataPreprocessor.numeric", lambda data, ctx : data.numeric(ctx.solvers), lambda ctx : (DataPreprocessor.from_frame(ctx.frame()), ctx)),
+        Case("DataPreprocessor.penalize", lambda data, ctx : data.penalize(ctx.solvers, ctx.timeout), lambda ctx : (DataPreprocessor.from_frame(ctx.frame()), ctx)),
+        Case("DataPreprocessor.vbs", lambda data, ctx : data.vbs(ctx.solvers), lambda ctx : (DataPreprocessor.from_frame(ctx.frame()), ctx)),
+        Case("DataPreprocessor.remainder", lambda data : data.remainder("family"), lambda ctx : (DataPreprocessor.from_frame(ctx.frame()),)),
+        Case("DataPreprocessor.numeric[compact]", lambda data, ctx : data.numeric(ctx.solvers), lambda ctx : (DataPreprocessor.from_frame(ctx.frame(), compact=True), ctx)),
+        Case("DataPreprocessor.penalize[compact]", lambda data, ctx : data.penalize(ctx.solvers, ctx.timeout), lambda ctx : (DataPreprocessor.from_frame(ctx.frame(), compact=True), ctx)),
+        Case("DataPreprocessor.remainder[compact]", lambda data : data.remainder("family"), lambda ctx : (DataPreprocessor.from_frame(ctx.frame(), compact=True),)),
+        Case("DataPreprocessor.matrix[compact]", lambda data, ctx : data.matrix(ctx.solvers, ctx.timeout), lambda ctx : (DataPreprocessor.from_frame(ctx.frame(), compact=True), ctx)),
+        Case("read_long", lambda ctx, path : read_long(path, ctx.timeout), lambda ctx : (ctx, ctx.long()), max_cells=10**7),
+        Case("live.Leaderboard.feed", lambda ctx, long : stream(live.Leaderboard(ctx.timeout), long), lambda ctx : (ctx, synthetic.long(ctx.df, ctx.solvers, ctx.timeout)), max_cells=10**7),
+        Case("Store.select[2 solvers]", lambda ctx, store : store.select(tracks=[ "main" ], solvers=ctx.top[:2]), lambda ctx : (ctx, ctx.store()), max_cells=10**8),
+        Case("Store.select[hashes]", lambda ctx, store : store.select(hashes=ctx.df["hash"].iloc[::1000].tolist()), lambda ctx : (ctx, ctx.store()), max_cells=10**8),
+        Case("cache.save_columns+load_columns", lambda ctx : (cache.save_columns(ctx.df, ctx.path("cache.npz")), cache.load_columns(ctx.path("cache.npz")))),
+        Case("scores.scores[frame]", lambda df : scores.scores(df), lambda ctx : (ctx.df[ctx.solvers],)),
+        Case("scores.scores[matrix]", lambda ctx : scores.scores(ctx.rm)),
+        Case("scores.aggregate", lambda ctx, df : scores.aggregate(df, ctx.solvers + [ "vbs" ], [ "family" ], [ "mean", "solved", "median", "gap" ], max_runtime=ctx.timeout), lambda ctx : (ctx, ctx.frame(vbs=True))),
+        Case("scores.scores_group_wise", lambda ctx, df : scores.scores_group_wise(df, ctx.solvers, [ "family" ], sortby="quot2"), lambda ctx : (ctx, ctx.frame(vbs=True))),
+        Case("curves.curves", lambda ctx : curves.curves(ctx.rm, ctx.solvers), max_cells=10**6),
+        Case("curves.curves[100 cutoffs]", lambda ctx : curves.curves(ctx.rm, ctx.solvers, cutoffs=np.linspace(0, ctx.timeout, 100))),
+        Case("curves.flips", lambda ctx : curves.flips(ctx.rm, ctx.solvers), max_cells=10**6),
+        Case("significance.significance", lambda ctx : significance.significance(ctx.rm, ctx.solvers), max_solvers=100),
+        Case("bootstrap.bootstrap[1000]", lambda ctx : bootstrap.bootstrap(ctx.rm, ctx.solvers, 1000), max_cells=10**7),
+        Case("portfolio.pscore", lambda ctx : pscore(ctx.rm, ctx.top)),
+        # generate(max_k) builds the portfolios up to size max_k - 1, the names give the largest size
+        Case("Portfolios.generate[k=2,beam=10]", lambda ctx : Portfolios.from_matrix(ctx.rm).generate(3, 10)),
+        Case("Portfolios.generate[k=4,beam=10]", lambda ctx : Portfolios.from_matrix(ctx.rm).generate(5, 10)),
+        Case("Portfolios.generate[k=4,beam=50]", lambda ctx : Portfolios.from_matrix(ctx.rm).generate(5, 50), max_solvers=100),
+        Case("Portfolios.generate[k=3,exact]", lambda ctx : Portfolios.from_matrix(ctx.rm).generate(4, 10, exact=True), max_solvers=100),
+        Case("Portfolios.generate[k=3,exact,missing]", lambda rm : Portfolios.from_matrix(rm).generate(4, 10, exact=True), lambda ctx : (ctx.missing(),), max_solvers=100, check=parity),
+        Case("schedule.schedule[greedy]", lambda ctx : schedule.schedule(ctx.rm, ctx.solvers), check=single),
+        Case("schedule.schedule[beam=10]", lambda ctx : schedule.schedule(ctx.rm, ctx.solvers, mode="beam"), max_solvers=100, check=single),
+        Case("cactus.cactus[pdf]", lambda ctx, df : cactus.cactus(df, ctx.solvers + [ "vbs" ], max=ctx.timeout, to_latex=ctx.path("cactus.pdf")), lambda ctx : (ctx, ctx.frame(vbs=True))),
+        Case("cactus.cdf[pdf]", lambda ctx, df : cactus.cdf(df, ctx.solvers + [ "vbs" ], max=ctx.timeout, to_latex=ctx.path("cdf.pdf")), lambda ctx : (ctx, ctx.frame(vbs=True))),
+        Case("cactus.cdfs[pdf pages]", lambda ctx, df : cactus.cdfs(df, ctx.solvers, "family", max=ctx.timeout, to_pdf=ctx.path("cdfs.pdf")), lambda ctx : (ctx, ctx.frame())),
+        Case("cactus.cdfs[pdf grid]", lambda ctx, df : cactus.cdfs(df, ctx.solvers, "family", max=ctx.timeout, to_pdf=ctx.path("grid.pdf"), grid=(3, 4)), lambda ctx : (ctx, ctx.frame())),
+        Case("scatter.scatter[pdf]", lambda ctx : scatter.scatter(ctx.df, ctx.top[0], ctx.top[1], "family", max=ctx.timeout, to_latex=ctx.path("scatter.pdf"))),
+        Case("scatter.scatter[density,pdf]", lambda ctx : scatter.scatter(ctx.df, ctx.top[0], ctx.top[1], "family", max=ctx.timeout, density=True, to_latex=ctx.path("density.pdf"))),
+    ]
+
+
+def measure(case: Case, ctx: Context, repeat: int):
+    # the first run is traced for peak memory (and warms up), the following runs are timed
+    args = case.setup(ctx)
+    tracemalloc.start()
+    result = case.run(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if case.check is not None:
+        case.check(result, *args)
+    times = []
+    for _ in range(repeat):
+        args = case.setup(ctx)
+        start = time.perf_counter()
+        case.run(*args)
+        times.append(time.perf_counter() - start)
+    return { "seconds": min(times), "median": float(np.median(times)), "repeats": repeat, "peak_bytes": peak }
+
+
+def revision():
+    try:
+        return subprocess.run([ "git", "rev-parse", "--short", "HEAD" ], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    headless()
+    sizes = [ tuple(map(int, size.split("x"))) for size in (args.sizes or PRESETS[args.preset]) ]
+    selected = [ case for case in cases() if not args.cases or any(fnmatch.fnmatch(case.name, pattern) for pattern in args.cases) ]
+    results, failed = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n, m in sizes:
+            eprint("generating {} instances x {} solvers".format(n, m))
+            ctx = Context(n, m, args.timeout, args.seed, tmp)
+            for case in selected:
+                if not case.applies(n, m):
+                    eprint("{:<40} {:>12} {:>10}".format(case.name, "{}x{}".format(n, m), "skipped"))
+                    continue
+                try:
+                    result = measure(case, ctx, args.repeat)
+                except ValueError as e:
+                    failed.append(case.name)
+                    eprint("{:<40} {:>12} {:>10} {}".format(case.name, "{}x{}".format(n, m), "failed", e))
+                    continue
+                results.append(dict(case=case.name, size="{}x{}".format(n, m), n=n, m=m, **result))
+                eprint("{:<40} {:>12} {:>10.4f}s {:>10.1f}MB".format(case.name, "{}x{}".format(n, m), result["seconds"], result["peak_bytes"] / 2**20))
+    meta = { "revision": revision(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "numpy": np.__version__,
+             "pandas": pd.__version__, "machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count(),
+             "seed": args.seed, "timeout": args.timeout }
+    with open(args.output, "w") as f:
+        json.dump({ "meta": meta, "results": results }, f, indent=1)
+    eprint("wrote {}".format(args.output))
+    if failed:
+        eprint("failed checks: {}".format(", ".join(failed)))
+        return 1
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = { (r["case"], r["size"]): r for r in json.load(f)["results"] }
+    with open(args.new) as f:
+        new = json.load(f)["results"]
+    print("{:<40} {:>12} {:>10} {:>10} {:>7} {:>7}".format("case", "size", "base", "new", "time", "memory"))
+    regressions = 0
+    for r in new:
+        b = base.get((r["case"], r["size"]))
+        if b is None:
+            continue
+        ratio = r["seconds"] / max(b["seconds"], 1e-9)
+        mem = r["peak_bytes"] / max(b["peak_bytes"], 1)
+        slower = ratio > 1 + args.threshold and r["seconds"] - b["seconds"] > args.min_seconds
+        bigger = mem > 1 + args.threshold and r["peak_bytes"] - b["peak_bytes"] > args.min_bytes
+        regressions += slower or bigger
+        print("{:<40} {:>12} {:>10.4f} {:>10.4f} {:>7.2f} {:>7.2f} {}".format(r["case"], r["size"], b["seconds"], r["seconds"], ratio, mem,
+                                                                               "REGRESSION" if slower or bigger else "faster" if ratio < 1 - args.threshold else ""))
+    print("{} regression(s) beyond {:.0%}".format(regressions, args.threshold))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gbd_eval on synthetic runtime matrices")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("run", help="run the benchmarks and write the results as JSON")
+    cmd.add_argument("-o", "--output", default="bench.json")
+    cmd.add_argument("-p", "--preset", choices=PRESETS.keys(), default="quick", help="predefined sizes")
+    cmd.add_argument("-s", "--sizes", nargs="+", help="sizes as <instances>x<solvers>, e.g. 100000x100")
+    cmd.add_argument("-c", "--cases", nargs="+", help="glob patterns of case names, e.g. 'Portfolios.*'")
+    cmd.add_argument("-r", "--repeat", type=int, default=3, help="number of timed runs per case (minimum is reported)")
+    cmd.add_argument("--timeout", type=int, default=5000)
+    cmd.add_argument("--seed", type=int, default=0)
+    cmd.set_defaults(func=run)
+
+    cmd = commands.add_parser("compare", help="compare two result files, exits with 1 on regressions")
+    cmd.add_argument("base")
+    cmd.add_argument("new")
+    cmd.add_argument("-t", "--threshold", type=float, default=.1, help="relative slowdown (or memory growth) reported as regression")
+    cmd.add_argument("--min-seconds", type=float, default=.001, help="ignore slowdowns below this absolute difference")
+    cmd.add_argument("--min-bytes", type=int, default=2**20, help="ignore memory growth below this absolute difference")
+    cmd.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args) or 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,24 @@
 #!/usr/bin/python3
 # run: ./eval.py
 
+import argparse
 import eval_sc2023
+from gbd_eval import trace
 
 
 def main():
-    eval_sc2023.generate()
+    parser = argparse.ArgumentParser(description="Generate the SC2023 evaluation artifacts")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of parallel jobs")
+    parser.add_argument("-k", "--keep-going", action="store_true", help="continue with independent jobs after a failure")
+    parser.add_argument("-f", "--force", action="store_true", help="rebuild all artifacts, even if up to date")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="list the jobs that would run")
+    parser.add_argument("--trace", help="append timing spans as JSON lines to this file")
+    parser.add_argument("--profile", help="store cProfile dumps of the spans matching --profile-spans in this directory")
+    parser.add_argument("--profile-spans", default="generator.*", help="glob pattern of profiled span names")
+    args = parser.parse_args()
+    if args.trace or args.profile:
+        trace.configure(args.trace, args.profile, args.profile_spans)
+    eval_sc2023.generate(jobs=args.jobs, keep_going=args.keep_going, force=args.force, dry_run=args.dry_run)
 
 if __name__ == '__main__':
     main()
@@ -16,22 +16,28 @@
 # run: ./eval.py
 
 import os
-import itertools
 import numpy as np
+import pandas as pd
 
 from gbd_core.api import GBD
-from gbd_eval import scatter, cactus, scores, tables, util
+from gbd_eval import scatter, cactus, curves, scores, tables, util, scheduler, bootstrap, shapley, schedule, significance, trace
 from gbd_eval.preprocess import DataPreprocessor
 from gbd_eval.portfolio import Portfolios
+from gbd_eval.selection import Selection
+from gbd_eval.scheduler import Job
+from gbd_eval.manifest import Manifest
+from gbd_eval.tracks import Tracks
 
 
 class Generator:
 
-    def __init__(self, query: str, dbs: list[str], solvers: list[str], target_dir: str, timeout: int = 5000):
+    # with a preloaded frame (hash, solvers and features of one track) no database is opened
+    def __init__(self, query: str, dbs: list[str], solvers: list[str], target_dir: str, timeout: int = 5000, frame: pd.DataFrame = None):
         self.query = query
-        self.gbd = GBD(dbs)
-        if not os.path.exists(target_dir):
-            os.makedirs(target_dir)
+        self.dbs = dbs
+        self.frame = frame
+        self.gbd = GBD(dbs) if frame is None else None
+        os.makedirs(target_dir, exist_ok=True)
         self.target_dir = target_dir
         self.solvers = solvers
         self.max_runtime = timeout
@@ -39,143 +45,195 @@ class Generator:
     def get_solvers(self):
         return self.solvers
 
+    def data(self, features: list[str]):
+        if self.frame is not None:
+            return DataPreprocessor.from_frame(self.frame[["hash"] + features].copy())
+        return DataPreprocessor(self.gbd, self.query, features)
+
+    def load(self):
+        # warms the query cache for all jobs on this track
+        self.data(self.solvers + ["family"])
+
     def generate_cdf_plot(self):
-        data = DataPreprocessor(self.gbd, self.query, self.solvers)
+        data = self.data(self.solvers)
         df = data.numeric(self.solvers).penalize(self.solvers, self.max_runtime).vbs(self.solvers).get()
         cactus.cactus(df.copy(), self.solvers + ["vbs"], holy=False, max=self.max_runtime, to_latex="{}/cdf.pdf".format(self.target_dir))
 
     def generate_cactus_plot(self):
-        data = DataPreprocessor(self.gbd, self.query, self.solvers)
+        data = self.data(self.solvers)
         df = data.numeric(self.solvers).penalize(self.solvers, self.max_runtime).vbs(self.solvers).get()
         cactus.cactus(df.copy(), self.solvers + ["vbs"], holy=True, max=self.max_runtime, to_latex="{}/cactus.pdf".format(self.target_dir))
 
+    def generate_par_plot(self, num: int = 7):
+        rm = self.data(self.solvers).matrix(self.solvers, self.max_runtime)
+        tab = curves.curves(rm, self.solvers)
+        cactus.par(tab, self.solvers, num=num, flips=curves.flips(rm, self.solvers), to_latex="{}/par.pdf".format(self.target_dir))
+        return tab
+
     def generate_scatter_plot(self, s0: str, s1: str, name: str):
-        data = DataPreprocessor(self.gbd, self.query, [s0, s1, "family"])
+        data = self.data([s0, s1, "family"])
         df = data.numeric([s0, s1]).penalize([s0, s1], self.max_runtime).remainder("family").get()
         scatter.scatter(df, s0, s1, "family", max=self.max_runtime, logscale=False, to_latex="{}/{}.pdf".format(self.target_dir, name))
         scatter.scatter(df, s0, s1, "family", max=self.max_runtime, logscale=True, to_latex="{}/{}_logscale.pdf".format(self.target_dir, name))
 
     def generate_family_wise_score_table(self, solvers: list[str], name: str, vbs_from: list[str] = None):
-        data = DataPreprocessor(self.gbd, self.query, solvers + ["family"])
+        data = self.data(solvers + ["family"])
         df = data.numeric(solvers).penalize(solvers, self.max_runtime).remainder("family").vbs(vbs_from or solvers).get()
         tab = scores.scores_group_wise(df, solvers, ["family"], sortby="quot2")
         tables.group_wise_scores(tab, solvers + [ "vbs" ], ["family"], "{}/{}.tex".format(self.target_dir, name), bold_min_of=solvers, min_diff=0)
     
-    def generate_cdf_per_family(self):
-        data = DataPreprocessor(self.gbd, self.query, self.solvers + ["family"])
+    def generate_cdf_per_family(self, pages: bool = False, grid: tuple = None, workers: int = None):
+        # a file per family, or with pages all families in cdf-families.pdf (on a grid of panels per page)
+        data = self.data(self.solvers + ["family"])
         df = data.numeric(self.solvers).penalize(self.solvers, self.max_runtime).remainder("family").vbs(self.solvers).get()
-        for fam in df["family"].unique():
-            subdf = df.query("family == '{}'".format(fam))
-            cactus.cdf(subdf, self.solvers, title=fam, num=7, max=self.max_runtime,
-                        #legend_separate="gen/sc2023/cdfs/leg-{}.pdf".format(fam), 
-                        to_latex="{}/cdf-{}.pdf".format(self.target_dir, fam))
-        
-    def generate_portfolios_table(self):
-        pfgen = Portfolios(self.gbd, self.query, self.solvers, self.max_runtime)
-        pfs = pfgen.generate(max_k=5, beam_width=10).sorted().get(n_best=1, rename=util.name)
+        if pages:
+            cactus.cdfs(df, self.solvers, "family", num=7, max=self.max_runtime, to_pdf="{}/cdf-families.pdf".format(self.target_dir), grid=grid)
+        else:
+            cactus.cdfs(df, self.solvers, "family", num=7, max=self.max_runtime, to_latex="{}/cdf-{{}}.pdf".format(self.target_dir), workers=workers)
+
+    def generate_portfolios_table(self, exact: bool = False, workers: int = None):
+        pfgen = Portfolios.from_matrix(self.data(self.solvers).matrix(self.solvers, self.max_runtime))
+        pfs = pfgen.generate(max_k=5, beam_width=10, exact=exact, workers=workers).sorted().get(n_best=1, rename=util.name)
         tables.best_k_portfolios(pfs, "{}/portfolios.tex".format(self.target_dir))
 
+    def generate_schedule_table(self, mode: str = "greedy"):
+        rm = self.data(self.solvers).matrix(self.solvers, self.max_runtime)
+        tab = schedule.schedule(rm, self.solvers, self.max_runtime, mode=mode)
+        tables.schedule(tab, "{}/schedule.tex".format(self.target_dir))
+        return tab
+
+    def generate_contributions_table(self):
+        rm = self.data(self.solvers).matrix(self.solvers, self.max_runtime)
+        tab = shapley.shapley(rm, self.solvers)
+        tables.scores(tab, to_latex="{}/contributions.tex".format(self.target_dir))
+        return tab
+
+    def generate_significance_table(self, correction: str = "holm", alpha: float = 0.05, workers: int = None):
+        # rank-biserial effects of all solver pairs (solvers by score), significant ones by the Wilcoxon test in bold
+        rm = self.data(self.solvers).matrix(self.solvers, self.max_runtime)
+        solvers = rm.scores(vbs=False).sort_values().index.tolist()
+        tab = significance.significance(rm, solvers, correction=correction, workers=workers)
+        tables.significance(significance.matrix(tab, "effect", solvers), significance.matrix(tab, "wilcoxon_q", solvers), to_latex="{}/significance.tex".format(self.target_dir), alpha=alpha)
+        return tab
+
+    def generate_selection_table(self, features: list[str], folds: int = 10, workers: int = None):
+        # requires a database with instance features, e.g. base.db
+        sel = Selection.from_gbd(self.gbd or GBD(self.dbs), self.query, features, self.solvers, self.max_runtime)
+        tab = sel.report(k=folds, workers=workers)
+        tables.scores(tab, to_latex="{}/selection.tex".format(self.target_dir))
+        return tab
+
     def get_best_portfolio(self, size: int = 3):
-        pfgen = Portfolios(self.gbd, self.query, self.solvers, self.max_runtime)
+        pfgen = Portfolios.from_matrix(self.data(self.solvers).matrix(self.solvers, self.max_runtime))
         pfs = pfgen.generate(max_k=size+1, beam_width=10).sorted().get(n_best=1)
         return pfs.query("k == {}".format(size))["portfolio"].values[0].split(",")
 
-    def get_scores_table(self, solvers: list[str], timeout_val: int = 10000):
-        data = DataPreprocessor(self.gbd, self.query, solvers)
-        df = data.numeric(solvers).penalize(solvers, self.max_runtime).vbs(solvers).get()
-        tab = scores.scores(df)
-        dfc = df[solvers + ["vbs"]].mask(lambda col: col >= timeout_val, np.nan).mask(lambda col: col < 10000, "yes").count().to_frame("solved")
-        tab = tab.merge(dfc, left_index=True, right_index=True)
+    def get_scores_table(self, solvers: list[str], timeout_val: int = 10000, replicates: int = 0, stratified: bool = False):
+        data = self.data(solvers + ["family"] if stratified else solvers)
+        rm = data.matrix(solvers, self.max_runtime)
+        tab = scores.scores(rm)
+        solved = np.append((rm.data < timeout_val).sum(axis=0), (rm.vbs() < timeout_val).sum())
+        tab = tab.merge(pd.Series(solved, index=solvers + ["vbs"]).to_frame("solved"), left_index=True, right_index=True)
+        if replicates:
+            strata = data.get()["family"].to_numpy() if stratified else None
+            ci = bootstrap.bootstrap(rm, solvers, replicates, strata=strata)[0]
+            tab = tab.merge(ci[["ci_low", "ci_high", "p_rank"]], left_index=True, right_index=True)
         tab.sort_values(by="score", ascending=True, inplace=True)
         return tab
 
 
-def generate():
+def generate(jobs: int = 1, keep_going: bool = False, force: bool = False, dry_run: bool = False):
     main = {
         "main": {
-            "files": ['data/meta.db', 'data/sc2023/results_main_detailed.csv'],
+            "file": 'data/sc2023/results_main_detailed.csv',
             "timeout": 5000,
-            "solvers": [],
             "sub": "all",
         },
         "main-sat": {
-            "files": ['data/meta.db', 'data/sc2023/results_main_sat_detailed.csv'],
+            "file": 'data/sc2023/results_main_sat_detailed.csv',
             "timeout": 5000,
-            "solvers": [],
             "sub": "sat",
         },
         "main-unsat": {
-            "files": ['data/meta.db', 'data/sc2023/results_main_unsat_detailed.csv'],
+            "file": 'data/sc2023/results_main_unsat_detailed.csv',
             "timeout": 5000,
-            "solvers": [],
             "sub": "unsat",
         },
         "special": {
-            "files": ['data/meta.db', 'data/sc2023/results_special_detailed.csv'],
+            "file": 'data/sc2023/results_special_detailed.csv',
             "timeout": 5000,
-            "solvers": [],
             "sub": "special",
         },
     }
 
     parallel = {
         "parallel": {
-            "files": ['data/meta.db', 'data/sc2023/results_parallel_detailed.csv'],
+            "file": 'data/sc2023/results_parallel_detailed.csv',
             "timeout": 5000,
-            "solvers": [],
             "sub": "all",
         },
         "parallel-sat": {
-            "files": ['data/meta.db', 'data/sc2023/results_parallel_sat_detailed.csv'],
+            "file": 'data/sc2023/results_parallel_sat_detailed.csv',
             "timeout": 5000,
-            "solvers": [],
             "sub": "sat",
         },
         "parallel-unsat": {
-            "files": ['data/meta.db', 'data/sc2023/results_parallel_unsat_detailed.csv'],
+            "file": 'data/sc2023/results_parallel_unsat_detailed.csv',
             "timeout": 5000,
-            "solvers": [],
             "sub": "unsat",
         },
     }
 
     cloud = {
         "cloud": {
-            "files": ['data/meta.db', 'data/sc2023/results_cloud_detailed.csv'],
+            "file": 'data/sc2023/results_cloud_detailed.csv',
             "timeout": 1000,
-            "solvers": [],
             "sub": "all",
         },
         "cloud-sat": {
-            "files": ['data/meta.db', 'data/sc2023/results_cloud_sat_detailed.csv'],
+            "file": 'data/sc2023/results_cloud_sat_detailed.csv',
             "timeout": 1000,
-            "solvers": [],
             "sub": "sat",
         },
         "cloud-unsat": {
-            "files": ['data/meta.db', 'data/sc2023/results_cloud_unsat_detailed.csv'],
+            "file": 'data/sc2023/results_cloud_unsat_detailed.csv',
             "timeout": 1000,
-            "solvers": [],
             "sub": "unsat",
         },
     }
 
+    # each track is loaded by its own job from its result file and the meta database, such that changing one file
+    # only invalidates the artifacts of that track and of its group's overall table
+    meta, query = "data/meta.db", "track = main_2023"
+    plan = []
     for tracks in [ main, parallel, cloud ]:
-        tab = None
         for track, data in tracks.items():
-            solvers = data["solvers"]
-            if not len(solvers):
-                solvers = [ GBD([file]).get_features() for file in data["files"][1:] ]
-                solvers = list(itertools.chain.from_iterable(solvers)) 
-                for trash in ["aresult", "vresult"]:
-                    if trash in solvers:
-                        solvers.remove(trash)
-            gen = Generator("track = main_2023", data["files"], solvers, "gen/sc2023/{}".format(track), data['timeout'])
-            subtab = gen.get_scores_table(solvers, timeout_val=data['timeout']*2)
-            tab = subtab if tab is None else tab.merge(subtab, left_index=True, right_index=True, suffixes=("", "_{}".format(data["sub"])))
-        print(tab)
-        #tab.reset_index(inplace=True, drop=True)
+            plan.append(Job("load:{}".format(track), load_track, (meta, query, data["file"]), inputs=[ meta, data["file"] ], outputs=[ "data:{}".format(track) ]))
+            spec = { "query": query, "dbs": [ meta, data["file"] ], "target_dir": "gen/sc2023/{}".format(track), "timeout": data["timeout"] }
+            for method, artifact in [ ("generate_cactus_plot", "cactus.pdf"), ("generate_cdf_plot", "cdf.pdf"), ("generate_par_plot", "par.pdf"),
+                                      ("generate_portfolios_table", "portfolios.tex"), ("generate_contributions_table", "contributions.tex"),
+                                      ("generate_schedule_table", "schedule.tex"), ("generate_significance_table", "significance.tex") ]:
+                plan.append(Job("{}:{}".format(artifact, track), run_generator, (spec, method), inputs=[ "data:{}".format(track) ], outputs=[ "{}/{}".format(spec["target_dir"], artifact) ], pass_inputs=True))
         target = "gen/sc2023/{}/overall".format(list(tracks.keys())[0])
-        tables.scores(tab, to_latex="{}.tex".format(target), to_html="{}.html".format(target))
-        #exit()
-        
\ No newline at end of file
+        timeouts = { track: data["timeout"] for track, data in tracks.items() }
+        plan.append(Job("overall:{}".format(list(tracks.keys())[0]), overall_scores_table, (timeouts, [ data["sub"] for data in tracks.values() ], target), 
+                        inputs=[ "data:{}".format(track) for track in tracks ], outputs=[ "{}.tex".format(target), "{}.html".format(target) ], pass_inputs=True))
+    manifest = Manifest("gen/sc2023/manifest.json")
+    scheduler.run(plan, n_jobs=jobs, keep_going=keep_going, manifest=manifest, force=force, dry_run=dry_run)
+
+
+def load_track(meta: str, query: str, path: str):
+    return Tracks.read(GBD([ meta ]), query, path)
+
+
+def run_generator(spec: dict, method: str, frame: pd.DataFrame, *args):
+    solvers = [ col for col in frame.columns if col not in [ "hash", "family" ] ]
+    with trace.span("generator.{}".format(method), track=spec["target_dir"], solvers=len(solvers)):
+        gen = Generator(spec["query"], spec["dbs"], solvers, spec["target_dir"], spec["timeout"], frame=frame)
+        return getattr(gen, method)(*args)
+
+
+def overall_scores_table(timeouts: dict, subs: list[str], target: str, *frames):
+    tab = Tracks.from_tracks(dict(zip(timeouts.keys(), frames)), timeouts).overall(list(timeouts.keys()), subs)
+    print(tab)
+    tables.scores(tab, to_latex="{}.tex".format(target), to_html="{}.html".format(target))
@@ -0,0 +1,84 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import numpy as np
+import pandas as pd
+
+from gbd_eval.runtimes import RuntimeMatrix, nanmean
+
+# maximum number of cells in one batch of resampling weights
+BATCH_CELLS = 2**24
+
+
+def counts(rng: np.random.Generator, n: int, replicates: int, strata: list[np.ndarray] = None):
+    # resampling weights: how often each instance is drawn in each replicate
+    if strata is None:
+        idx = rng.integers(0, n, (replicates, n))
+    else:
+        idx = np.concatenate([ members[rng.integers(0, len(members), (replicates, len(members)))] for members in strata ], axis=1)
+    offsets = (np.arange(replicates) * n)[:, None]
+    return np.bincount((idx + offsets).ravel(), minlength=replicates * n).reshape(replicates, n).astype(np.float64)
+
+
+def resample(X: np.ndarray, replicates: int = 10000, seed: int = 0, strata=None):
+    # returns the mean penalized runtime of each column in each replicate (replicates x columns)
+    rng = np.random.default_rng(seed)
+    valid = ~np.isnan(X)
+    X0 = np.where(valid, X, 0)
+    valid = valid.astype(np.float64)
+    groups = None
+    if strata is not None:
+        codes = pd.factorize(np.asarray(strata))[0]
+        groups = [ np.flatnonzero(codes == g) for g in range(codes.max() + 1) ]
+    n = X.shape[0]
+    step = max(1, BATCH_CELLS // max(n, X.shape[1] ** 2))
+    out = np.empty((replicates, X.shape[1]))
+    for b in range(0, replicates, step):
+        W = counts(rng, n, min(step, replicates - b), groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[b:b+len(W)] = (W @ X0) / (W @ valid)
+    return out
+
+
+def bootstrap(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], replicates: int = 10000, alpha: float = 0.05, strata=None, seed: int = 0, vbs: bool = True):
+    rm = df if isinstance(df, RuntimeMatrix) else RuntimeMatrix.from_frame(df, solvers)
+    if isinstance(strata, str):
+        strata = df[strata].to_numpy()
+    X = rm.columns(solvers)
+    if vbs:
+        X = np.column_stack([ X, rm.vbs(solvers) ])
+    samples = resample(X, replicates, seed, strata)
+    names = solvers + ([ "vbs" ] if vbs else [])
+
+    s = len(solvers)
+    S = samples[:, :s]
+    # rank probabilities and pairwise dominance among the solvers
+    ranks = np.argsort(np.argsort(S, axis=1, kind='stable'), axis=1)
+    rank_prob = np.bincount((np.arange(s) * s + ranks).ravel(), minlength=s * s).reshape(s, s) / replicates
+    beats = np.zeros((s, s))
+    step = max(1, BATCH_CELLS // (s * s))
+    for b in range(0, replicates, step):
+        beats += (S[b:b+step, :, None] < S[b:b+step, None, :]).sum(axis=0)
+    beats /= replicates
+
+    low, high = np.nanquantile(samples, [ alpha / 2, 1 - alpha / 2 ], axis=0)
+    score = nanmean(X, axis=0)
+    tab = pd.DataFrame({ "score": score, "ci_low": low, "ci_high": high }, index=names)
+    observed = np.argsort(np.argsort(score[:s], kind='stable'), kind='stable')
+    tab["p_rank"] = np.append(rank_prob[np.arange(s), observed], [ np.nan ] * (len(names) - s))
+    rank_prob = pd.DataFrame(rank_prob, index=solvers, columns=range(1, s + 1))
+    beats = pd.DataFrame(beats, index=solvers, columns=solvers)
+    return tab, rank_prob, beats
@@ -0,0 +1,180 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# GBD_EVAL_CACHE=off disables caching, any other value is used as cache directory
+CACHE_DIR = os.environ.get("GBD_EVAL_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "gbd_eval"))
+MEMORY_LIMIT = int(os.environ.get("GBD_EVAL_CACHE_MEMORY", 512 * 2**20))
+
+
+def databases(gbd):
+    try:
+        return sorted(schema.path for schema in gbd.database.schemas.values())
+    except AttributeError:
+        return None
+
+
+_digests = {}
+
+def fingerprint(path: str, content: bool = False):
+    st = os.stat(path)
+    fp = [ os.path.abspath(path), st.st_mtime_ns, st.st_size ]
+    if content:
+        if tuple(fp) not in _digests:
+            h = hashlib.sha1()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(2**20), b""):
+                    h.update(chunk)
+            _digests[tuple(fp)] = h.hexdigest()
+        fp.append(_digests[tuple(fp)])
+    return fp
+
+
+def digest(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# columnar storage: one npz member per column, strings as unicode arrays plus null mask
+def save_columns(df: pd.DataFrame, path: str):
+    arrays = { "__columns__": np.array(df.columns.tolist(), dtype=str) }
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        if values.dtype.kind in "biuf":
+            arrays["c{}".format(i)] = values.to_numpy()
+        else:
+            null = values.isna().to_numpy()
+            arrays["c{}".format(i)] = np.where(null, "", values.astype(str).to_numpy()).astype(str)
+            if null.any():
+                arrays["n{}".format(i)] = null
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+def load_columns(path: str, columns: list[str] = None):
+    with np.load(path, allow_pickle=False) as npz:
+        stored = npz["__columns__"].tolist()
+        data = {}
+        for col in (columns or stored):
+            i = stored.index(col)
+            values = npz["c{}".format(i)]
+            if values.dtype.kind == "U":
+                values = values.astype(object)
+                if "n{}".format(i) in npz.files:
+                    values[npz["n{}".format(i)]] = None
+            data[col] = values
+    return pd.DataFrame(data)
+
+def stored_columns(path: str):
+    with np.load(path, allow_pickle=False) as npz:
+        return npz["__columns__"].tolist()
+
+
+class QueryCache:
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = MEMORY_LIMIT, content_hash: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+        self.lru = OrderedDict()
+        self.nbytes = 0
+
+    def key(self, gbd, query: str):
+        dbs = databases(gbd)
+        if dbs is None:
+            return None
+        return digest([ [ fingerprint(db, self.content_hash) for db in dbs ], query ])
+
+    def query(self, gbd, query: str, features: list[str]):
+        base = self.key(gbd, query)
+        if base is None:
+            return gbd.query(query, resolve=features)
+        columns = [ "hash" ] + [ f for f in dict.fromkeys(features) if f != "hash" ]
+        df = self.lookup(base, columns)
+        if df is None:
+            df = gbd.query(query, resolve=features)
+            self.store(base, df)
+        return df[columns].copy()
+
+    def lookup(self, base: str, columns: list[str]):
+        # superset hits are served by column projection
+        for (b, cols), (df, _) in reversed(self.lru.items()):
+            if b == base and set(columns) <= set(cols):
+                self.lru.move_to_end((b, cols))
+                return df
+        folder = os.path.join(self.directory, base)
+        if os.path.isdir(folder):
+            for file in sorted(os.listdir(folder)):
+                if not file.endswith(".npz"):
+                    continue
+                path = os.path.join(folder, file)
+                try:
+                    if set(columns) <= set(stored_columns(path)):
+                        df = load_columns(path, columns)
+                        self.remember(base, df)
+                        return df
+                except (OSError, ValueError, KeyError):
+                    continue
+        return None
+
+    def store(self, base: str, df: pd.DataFrame):
+        self.remember(base, df)
+        folder = os.path.join(self.directory, base)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            save_columns(df, os.path.join(folder, "{}.npz".format(digest(sorted(df.columns.tolist())))))
+        except OSError:
+            pass
+
+    def remember(self, base: str, df: pd.DataFrame):
+        key = (base, tuple(df.columns))
+        if key in self.lru:
+            return
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        self.lru[key] = (df, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, old) = self.lru.popitem(last=False)
+            self.nbytes -= old
+
+    def clear(self):
+        self.lru.clear()
+        self.nbytes = 0
+
+
+_default = None
+
+def default():
+    global _default
+    if _default is None and CACHE_DIR != "off":
+        _default = QueryCache()
+    return _default
+
+def query(gbd, query: str, features: list[str]):
+    cache = default()
+    if cache is None:
+        return gbd.query(query, resolve=features)
+    return cache.query(gbd, query, features)
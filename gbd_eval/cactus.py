@@ -14,30 +14,48 @@
 
 # run: ./eval.py
 
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
-from gbd_eval.scatter import export_legend
+from gbd_eval import runtimes, trace
+from gbd_eval.scatter import export_legend, partition
+from gbd_eval.scheduler import headless
 from gbd_eval.util import name
 
 
-def plt_decorate_cactus_plot_area(num=400, min=0, max=5000, holy=False):
-    plt.grid(linestyle='dashed', linewidth=.5, color='lightgrey', zorder=0)
+def plt_decorate_cactus_plot_area(num=400, min=0, max=5000, holy=False, ax=None):
+    ax = ax or plt.gca()
+    ax.grid(linestyle='dashed', linewidth=.5, color='lightgrey', zorder=0)
     if holy:
-        plt.xlim(0, num)
-        plt.ylim(min, max + (max - min) / 100)
+        ax.set_xlim(0, num)
+        ax.set_ylim(min, max + (max - min) / 100)
     else:
-        plt.xlim(min, max + (max - min) / 100)
-        plt.ylim(0, num)
+        ax.set_xlim(min, max + (max - min) / 100)
+        ax.set_ylim(0, num)
+
+
+def steps(values: np.ndarray, max=5000, resolution=None):
+    # sorted step curve, reduced to the points where it changes at the given resolution
+    y = np.sort(values)
+    x = np.arange(len(y))
+    if resolution is None or len(y) <= 2 * resolution:
+        return x, y
+    qx = x * resolution // len(y)
+    qy = np.floor(np.nan_to_num(y, nan=-1) * resolution / max)
+    keep = np.ones(len(y), dtype=bool)
+    keep[1:-1] = (qx[1:-1] != qx[:-2]) | (qy[1:-1] != qy[:-2]) | (qy[1:-1] != qy[2:])
+    return x[keep], y[keep]
 
 
-def cactus(df: pd.DataFrame, solvers: list[str], title=None, num=17, max=5000, legend_separate=None, to_latex=None, holy=True):
+def draw(ax, X: np.ndarray, solvers: list[str], title=None, num=17, max=5000, holy=True, resolution=1000, n_markers=40, rasterized=False, k=2):
+    # curves of the num solvers with the lowest mean runtime (the columns of X) on ax, which may be reused after ax.clear()
     colors = ['#113377','#e41a1c','#377eb8','#4daf4a','#984ea3','#ff7f00','#a65628']
     markers = [ '1', 'x', '*', '+', '.' ]
 
-    fig, ax = plt.subplots(figsize=(3.5,3.5))
-
-    plt_decorate_cactus_plot_area(len(df.index), min=0, max=max, holy=holy)
+    plt_decorate_cactus_plot_area(len(X), min=0, max=max, holy=holy, ax=ax)
     if title is not None:
         ax.set_title(title, fontsize=6, variant='small-caps')
     # remove spines:
@@ -46,44 +64,163 @@ def cactus(df: pd.DataFrame, solvers: list[str], title=None, num=17, max=5000, l
     ax.spines['bottom'].set_visible(False)
     ax.spines['left'].set_visible(False)
 
-    df2 = pd.concat([df[col].sort_values(ascending=True, ignore_index=True) for col in solvers], axis=1)
-    avg = df2.mean(numeric_only=True)
-    solvers.sort(key=lambda x: avg[x])
-
+    avg = runtimes.nanmean(X, axis=0)
+    order = sorted(range(len(solvers)), key=lambda j: avg[j])
 
-    k = 1 if to_latex is not None else 2
-    
-    lines = []
-    for i, col in enumerate(solvers[:num], 0):
+    for i, j in enumerate(order[:num], 0):
         m = markers[i % len(markers)]
         c = colors[i % len(colors)]
         o = len(solvers) - i
-        line = ax.plot(df2[col], label=name(col), zorder=o, marker=m, color=c, fillstyle='none', alpha=.7, linewidth=.5*k, markeredgewidth=.5*k, markersize=3*k, drawstyle='steps-post')
-        lines.append(line[0])
+        x, y = steps(X[:, j], max, resolution)
+        every = len(x) // n_markers or 1 if len(x) < len(X) else 1
+        if not holy:
+            x, y = y, x
+        ax.plot(x, y, label=name(solvers[j]), zorder=o, marker=m, color=c, fillstyle='none', alpha=.7, linewidth=.5*k, markeredgewidth=.5*k, markersize=3*k, drawstyle='steps-post', markevery=every, rasterized=rasterized)
+
+    if not holy:
+        ax.set_aspect(max / len(X))
+    else:
+        ax.set_aspect(len(X) / max)
+
 
-    lege = plt.legend(loc='center left', bbox_to_anchor=(1.0, .5), ncol=1, frameon=False, fontsize='x-small', borderaxespad=1.5, columnspacing=0, labelspacing=.7)
+def legend(ax):
+    return ax.legend(loc='center left', bbox_to_anchor=(1.0, .5), ncol=1, frameon=False, fontsize='x-small', borderaxespad=1.5, columnspacing=0, labelspacing=.7)
+
+
+def savefig(fig, to_latex, rasterized=False):
+    with trace.span("cactus.savefig"):
+        fig.savefig(to_latex, bbox_inches='tight', pad_inches=0.1, dpi=300 if rasterized else 'figure')
+
+
+@trace.traced("cactus.cactus")
+def cactus(df: pd.DataFrame, solvers: list[str], title=None, num=17, max=5000, legend_separate=None, to_latex=None, holy=True, resolution=1000, n_markers=40, rasterized=False):
+    trace.current().set(rows=len(df.index), cols=len(solvers), artifact=to_latex)
+
+    fig, ax = plt.subplots(figsize=(3.5,3.5))
+    k = 1 if to_latex is not None else 2
+    draw(ax, runtimes.parse(df, solvers), solvers, title, num, max, holy, resolution, n_markers, rasterized, k)
+
+    lege = legend(ax)
 
     if legend_separate is not None:
         export_legend(lege, legend_separate)
         lege.remove()
 
-    if not holy:
-        for line in lines:
-            xdata, ydata = line.get_xdata(), line.get_ydata()
-            line.set_xdata(ydata)
-            line.set_ydata(xdata)
-        ax.set_aspect(max / len(df2.index))
-    else:
-        ax.set_aspect(len(df2.index) / max)
-
     if to_latex is None:
         plt.show()
     else:
-        plt.savefig(to_latex, bbox_inches='tight', pad_inches=0.1)
+        savefig(fig, to_latex, rasterized)
 
-    plt.close()
+    plt.close(fig)
 
 
-def cdf(df: pd.DataFrame, solvers: list[str], title=None, num=17, max=5000, legend_separate=None, to_latex=None):
-    cactus(df, solvers=solvers, title=title, num=num, max=max, legend_separate=legend_separate, to_latex=to_latex, holy=False)
+def cdf(df: pd.DataFrame, solvers: list[str], title=None, num=17, max=5000, legend_separate=None, to_latex=None, resolution=1000, n_markers=40, rasterized=False):
+    cactus(df, solvers=solvers, title=title, num=num, max=max, legend_separate=legend_separate, to_latex=to_latex, holy=False, resolution=resolution, n_markers=n_markers, rasterized=rasterized)
+
+
+def render(panels: list[tuple], paths: list[str], num=17, max=5000, holy=False, resolution=1000, n_markers=40, rasterized=False):
+    # one figure for all panels (title, runtimes, solvers), each saved to its own file
+    fig, ax = plt.subplots(figsize=(3.5,3.5))
+    for (title, X, solvers), path in zip(panels, paths):
+        ax.clear()
+        draw(ax, X, solvers, title, num, max, holy, resolution, n_markers, rasterized, k=1)
+        legend(ax)
+        savefig(fig, path, rasterized)
+    plt.close(fig)
+    return len(paths)
+
+
+def _render(job: tuple):
+    return render(*job[:2], **job[2])
+
+
+@trace.traced("cactus.cdfs")
+def cdfs(df: pd.DataFrame, solvers: list[str], group: str, num=7, max=5000, to_latex=None, to_pdf=None, grid=None, workers=None, holy=False, resolution=1000, n_markers=40, rasterized=False):
+    # one CDF (or cactus plot) per group, e.g. family, from a single partition of the rows:
+    # to_latex is a file name pattern with '{}' for the group name, the files are rendered by a pool of workers each reusing one figure,
+    # to_pdf a multi-page PDF with one group per page, or with grid=(rows, cols) one page of panels per rows*cols groups
+    X = runtimes.parse(df, solvers)
+    names, _, order, bounds = partition(df[group])
+    groups = [ (str(n), order[bounds[g]:bounds[g + 1]]) for g, n in enumerate(names) ]
+    trace.current().set(rows=len(df.index), cols=len(solvers), groups=len(groups), artifact=to_pdf or to_latex)
+    panels = [ (title, X[rows], solvers) for title, rows in groups ]
+    options = { "num": num, "max": max, "holy": holy, "resolution": resolution, "n_markers": n_markers, "rasterized": rasterized }
+    if to_latex is not None:
+        paths = [ to_latex.format(title) for title, _ in groups ]
+        if workers is None or workers < 2 or len(panels) < 2:
+            render(panels, paths, **options)
+        else:
+            jobs = [ (panels[w::workers], paths[w::workers], options) for w in range(min(workers, len(panels))) ]
+            with ProcessPoolExecutor(len(jobs), initializer=headless) as pool:
+                list(pool.map(_render, jobs))
+    if to_pdf is not None:
+        from matplotlib.backends.backend_pdf import PdfPages
+        # pages have a fixed layout (legends to the right of single plots, in the empty corner of the panels of a grid),
+        # such that each page is drawn once, and not again to find its bounding box
+        rows, cols = grid or (1, 1)
+        fig, axes = plt.subplots(rows, cols, figsize=(3.5*cols, 3.5*rows) if grid else (6, 3.5), squeeze=False)
+        fig.subplots_adjust(left=.1, right=.95 if grid else .62, bottom=.1, top=.9, wspace=.3, hspace=.3)
+        with PdfPages(to_pdf) as pdf:
+            for start in range(0, len(panels), rows * cols):
+                for ax, panel in zip(axes.flat, panels[start:start + rows * cols] + [ None ] * (rows * cols)):
+                    ax.clear()
+                    ax.set_visible(panel is not None)
+                    if panel is not None:
+                        title, X, solvers = panel
+                        draw(ax, X, solvers, title, num, max, holy, resolution, n_markers, rasterized, k=1)
+                        if grid is None:
+                            ax.legend(loc='center left', bbox_to_anchor=(1.0, .5), ncol=1, frameon=False, fontsize='x-small', labelspacing=.7)
+                        else:
+                            ax.legend(loc='upper left' if holy else 'lower right', frameon=False, fontsize='xx-small')
+                with trace.span("cactus.savefig"):
+                    pdf.savefig(fig, dpi=300 if rasterized else 'figure')
+        plt.close(fig)
+
+
+@trace.traced("cactus.par")
+def par(curves: pd.DataFrame, solvers: list[str], stat="score", title=None, num=17, flips: pd.DataFrame = None, to_latex=None, n_markers=40, rasterized=False):
+    # PAR-k score (stat="score") or solved count (stat="solved") over the cutoff, from curves.curves,
+    # with the cutoffs at which the plotted solvers swap ranks (from curves.flips) as dashed lines
+    colors = ['#113377','#e41a1c','#377eb8','#4daf4a','#984ea3','#ff7f00','#a65628']
+    markers = [ '1', 'x', '*', '+', '.' ]
+    trace.current().set(rows=len(curves.index), cols=len(solvers), artifact=to_latex)
+
+    fig, ax = plt.subplots(figsize=(3.5,3.5))
+    ax.grid(linestyle='dashed', linewidth=.5, color='lightgrey', zorder=0)
+    if title is not None:
+        ax.set_title(title, fontsize=6, variant='small-caps')
+    for side in [ 'top', 'right', 'bottom', 'left' ]:
+        ax.spines[side].set_visible(False)
+
+    # solvers in the order of their score at the largest cutoff, without sorting the caller's list
+    final = curves["score"].iloc[-1]
+    solvers = sorted(solvers, key=lambda x: final[x])[:num]
+
+    k = 1 if to_latex is not None else 2
+
+    # counts change right after each cutoff (runs with c_i <= runtime < c_{i+1} count from c_{i+1} on), scores drop
+    # right after each cutoff and are linear in between, which the dense grid of curves.curves draws closely
+    x = curves.index.to_numpy()
+    style = 'steps-pre' if stat == "solved" else 'default'
+    every = len(x) // n_markers or 1
+    for i, col in enumerate(solvers, 0):
+        m = markers[i % len(markers)]
+        c = colors[i % len(colors)]
+        ax.plot(x, curves[stat][col].to_numpy(), label=name(col), zorder=len(solvers) - i, marker=m, color=c, fillstyle='none', alpha=.7, linewidth=.5*k, markeredgewidth=.5*k, markersize=3*k, markevery=every, drawstyle=style, rasterized=rasterized)
+
+    if flips is not None:
+        shown = flips[flips["solver"].isin(solvers) & flips["overtaken"].isin(solvers)]
+        for cutoff in shown["cutoff"].unique():
+            ax.axvline(cutoff, linestyle='dashed', linewidth=.3*k, color='grey', alpha=.5, zorder=0)
+
+    ax.set_xlim(x.min(), x.max())
+    ax.set_xlabel("cutoff", fontsize='x-small')
+    ax.set_ylabel("PAR score" if stat == "score" else "solved", fontsize='x-small')
+    legend(ax)
+
+    if to_latex is None:
+        plt.show()
+    else:
+        savefig(fig, to_latex, rasterized)
 
+    plt.close(fig)
@@ -0,0 +1,234 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./gbd-eval --help
+
+import os
+import argparse
+
+# only argparse is imported eagerly, numpy, pandas and gbd_core are imported by the commands,
+# matplotlib only by the plotting commands (always with a non-interactive backend)
+
+
+def headless():
+    from gbd_eval.scheduler import headless
+    headless()
+
+
+def detect_solvers(dbs: list[str]):
+    # solvers are the features of the result databases (all but the first, if there are several)
+    from gbd_core.api import GBD
+    solvers = [ f for db in (dbs[1:] or dbs) for f in GBD([db]).get_features() ]
+    return [ s for s in dict.fromkeys(solvers) if s not in [ "aresult", "vresult" ] ]
+
+
+class Track:
+
+    def __init__(self, args):
+        from gbd_core.api import GBD
+        self.gbd = GBD(args.db)
+        self.query = args.query
+        self.timeout = args.timeout
+        self.solvers = args.solvers or detect_solvers(args.db)
+
+    def data(self, features: list[str]):
+        from gbd_eval.preprocess import DataPreprocessor
+        return DataPreprocessor(self.gbd, self.query, features)
+
+    def frame(self, solvers: list[str], group: str = None):
+        data = self.data(solvers + ([ group ] if group else []))
+        data.numeric(solvers).penalize(solvers, self.timeout)
+        if group:
+            data.remainder(group)
+        return data.vbs(solvers).get()
+
+
+def output(args, default: str):
+    path = args.output or default
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return path
+
+
+def scores_table(track: Track, solved_below: int = None, replicates: int = 0):
+    import numpy as np
+    import pandas as pd
+    from gbd_eval import scores
+    rm = track.data(track.solvers).matrix(track.solvers, track.timeout)
+    tab = scores.scores(rm)
+    below = solved_below or 2 * track.timeout
+    solved = np.append((rm.data < below).sum(axis=0), (rm.vbs() < below).sum())
+    tab["solved"] = pd.Series(solved, index=track.solvers + [ "vbs" ])
+    if replicates:
+        from gbd_eval import bootstrap
+        ci = bootstrap.bootstrap(rm, track.solvers, replicates)[0]
+        tab = tab.merge(ci[["ci_low", "ci_high", "p_rank"]], left_index=True, right_index=True)
+    return tab.sort_values(by="score", ascending=True)
+
+def cmd_scores(args, track: Track):
+    tab = scores_table(track, args.solved_below, args.replicates)
+    print(tab.to_string(float_format="{:.2f}".format))
+    if args.latex or args.html:
+        from gbd_eval import tables
+        tables.scores(tab, to_latex=args.latex, to_html=args.html)
+
+
+def portfolios_table(track: Track, max_k: int = 5, beam_width: int = 10, exact: bool = False, workers: int = None):
+    from gbd_eval import util
+    from gbd_eval.portfolio import Portfolios
+    pfgen = Portfolios(track.gbd, track.query, track.solvers, track.timeout)
+    return pfgen.generate(max_k=max_k, beam_width=beam_width, exact=exact, workers=workers).sorted().get(n_best=1, rename=util.name)
+
+def cmd_portfolios(args, track: Track):
+    pfs = portfolios_table(track, args.max_k, args.beam_width, args.exact, args.workers)
+    print(pfs.to_string(index=False, float_format="{:.2f}".format))
+    if args.latex:
+        from gbd_eval import tables
+        tables.best_k_portfolios(pfs, args.latex)
+
+
+def cmd_cactus(args, track: Track):
+    headless()
+    from gbd_eval import cactus
+    df = track.frame(track.solvers)
+    holy = not args.cdf
+    cactus.cactus(df, track.solvers + [ "vbs" ], holy=holy, max=track.timeout, to_latex=output(args, "cactus.pdf" if holy else "cdf.pdf"))
+
+
+def cmd_scatter(args, track: Track):
+    headless()
+    from gbd_eval import scatter
+    solvers = [ args.solver1, args.solver2 ]
+    df = track.data(solvers + [ args.group ]).numeric(solvers).penalize(solvers, track.timeout).remainder(args.group).get()
+    scatter.scatter(df, args.solver1, args.solver2, args.group, max=track.timeout, logscale=args.logscale, density=args.density,
+                    to_latex=output(args, "{}_vs_{}.pdf".format(args.solver1, args.solver2)))
+
+
+def cmd_family_table(args, track: Track):
+    from gbd_eval import scores, tables
+    df = track.frame(track.solvers, args.group)
+    tab = scores.scores_group_wise(df, track.solvers, [ args.group ], sortby=args.sortby)
+    print(tab.to_string(index=False, float_format="{:.2f}".format))
+    tables.group_wise_scores(tab, track.solvers + [ "vbs" ], [ args.group ], output(args, "{}_scores.tex".format(args.group)), bold_min_of=track.solvers, min_diff=0)
+
+
+def cmd_all(args, track: Track):
+    headless()
+    from gbd_eval import cactus, tables
+    target = args.output or "."
+    os.makedirs(target, exist_ok=True)
+    tables.scores(scores_table(track), to_latex=os.path.join(target, "scores.tex"), to_html=os.path.join(target, "scores.html"))
+    tables.best_k_portfolios(portfolios_table(track, workers=args.workers), os.path.join(target, "portfolios.tex"))
+    df = track.frame(track.solvers)
+    cactus.cactus(df.copy(), track.solvers + [ "vbs" ], holy=True, max=track.timeout, to_latex=os.path.join(target, "cactus.pdf"))
+    cactus.cdf(df.copy(), track.solvers + [ "vbs" ], max=track.timeout, to_latex=os.path.join(target, "cdf.pdf"))
+
+
+def cmd_watch(args, track: Track):
+    from gbd_eval import cache, live
+    families = None
+    if args.meta:
+        from gbd_core.api import GBD
+        meta = cache.query(GBD([ args.meta ]), args.query, [ "family" ]).drop_duplicates("hash")
+        families = dict(zip(meta["hash"], meta["family"]))
+    board = live.Leaderboard(args.timeout, reducer=args.reducer, families=families, max_k=args.max_k, beam_width=args.beam_width)
+    target = args.output or "live"
+    try:
+        live.watch(board, live.follow(args.files, poll=args.poll, once=args.once), target, interval=args.interval, refresh=args.refresh)
+    except KeyboardInterrupt:
+        pass
+    print(board.scores().to_string(float_format="{:.2f}".format))
+
+
+def parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-d", "--db", nargs="+", required=True, help="GBD databases, e.g. a meta database followed by result databases")
+    common.add_argument("-q", "--query", default="", help="GBD query selecting the instances")
+    common.add_argument("-t", "--timeout", type=int, default=5000, help="runtime limit, larger runtimes are penalized (PAR-2)")
+    common.add_argument("-s", "--solvers", nargs="+", help="solver columns (default: all features of the result databases)")
+    common.add_argument("-o", "--output", help="output file (directory for 'all')")
+
+    parser = argparse.ArgumentParser(prog="gbd-eval", description="Evaluate solver runtimes from GBD databases")
+    parser.add_argument("--trace", help="append timing spans as JSON lines to this file")
+    parser.add_argument("--profile", help="store a cProfile dump of the command in this directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("scores", parents=[ common ], help="print PAR-2 scores and solved counts")
+    cmd.add_argument("--solved-below", type=int, help="count runs below this runtime as solved (default: 2 * timeout)")
+    cmd.add_argument("--replicates", type=int, default=0, help="number of bootstrap replicates for confidence intervals")
+    cmd.add_argument("--latex", help="write the table as LaTeX")
+    cmd.add_argument("--html", help="write the table as HTML")
+    cmd.set_defaults(func=cmd_scores)
+
+    cmd = commands.add_parser("portfolios", parents=[ common ], help="print the best portfolios of each size")
+    cmd.add_argument("--max-k", type=int, default=5, help="maximum portfolio size")
+    cmd.add_argument("--beam-width", type=int, default=10, help="number of portfolios extended per size")
+    cmd.add_argument("--exact", action="store_true", help="exact search for sizes beyond two")
+    cmd.add_argument("--workers", type=int, help="number of worker processes")
+    cmd.add_argument("--latex", help="write the table as LaTeX")
+    cmd.set_defaults(func=cmd_portfolios)
+
+    cmd = commands.add_parser("cactus", parents=[ common ], help="plot a cactus plot (or cdf)")
+    cmd.add_argument("--cdf", action="store_true", help="plot the cumulative distribution instead")
+    cmd.set_defaults(func=cmd_cactus)
+
+    cmd = commands.add_parser("scatter", parents=[ common ], help="plot runtimes of two solvers")
+    cmd.add_argument("solver1")
+    cmd.add_argument("solver2")
+    cmd.add_argument("--group", default="family", help="feature used for coloring")
+    cmd.add_argument("--logscale", action="store_true")
+    cmd.add_argument("--density", action="store_true", help="hexbin density instead of points")
+    cmd.set_defaults(func=cmd_scatter)
+
+    cmd = commands.add_parser("family-table", parents=[ common ], help="write group-wise scores as LaTeX")
+    cmd.add_argument("--group", default="family", help="feature to group by")
+    cmd.add_argument("--sortby", default="quot2", help="column to sort the groups by")
+    cmd.set_defaults(func=cmd_family_table)
+
+    cmd = commands.add_parser("all", parents=[ common ], help="write scores, portfolios, cactus and cdf to the output directory")
+    cmd.add_argument("--workers", type=int, help="number of worker processes")
+    cmd.set_defaults(func=cmd_all)
+
+    cmd = commands.add_parser("watch", help="follow growing result files and keep leaderboard snapshots up to date")
+    cmd.add_argument("files", nargs="+", help="result files with records hash,solver,runtime[,status] (CSV with header, or .jsonl)")
+    cmd.add_argument("-t", "--timeout", type=int, default=5000, help="runtime limit, larger runtimes are penalized (PAR-2)")
+    cmd.add_argument("-m", "--meta", help="GBD database with the instance families, only its instances are counted")
+    cmd.add_argument("-q", "--query", default="", help="GBD query selecting the instances from the meta database")
+    cmd.add_argument("-o", "--output", help="snapshot directory (default: live)")
+    cmd.add_argument("--interval", type=float, default=5, help="seconds between snapshots")
+    cmd.add_argument("--refresh", type=float, default=60, help="seconds between portfolio searches")
+    cmd.add_argument("--poll", type=float, default=1, help="seconds between looks at the files")
+    cmd.add_argument("--reducer", choices=[ "last", "min" ], default="last", help="which of several records of a run counts")
+    cmd.add_argument("--max-k", type=int, default=3, help="maximum portfolio size")
+    cmd.add_argument("--beam-width", type=int, default=10, help="number of portfolios tracked per size")
+    cmd.add_argument("--once", action="store_true", help="stop at the current end of the files")
+    cmd.set_defaults(func=cmd_watch)
+
+    return parser
+
+
+def main(argv: list[str] = None):
+    args = parser().parse_args(argv)
+    # watch reads result files, not databases
+    track = lambda : Track(args) if "db" in args else None
+    if args.trace or args.profile:
+        from gbd_eval import trace
+        trace.configure(args.trace, args.profile, "gbd-eval *")
+        with trace.span("gbd-eval {}".format(args.command)):
+            args.func(args, track())
+    else:
+        args.func(args, track())
+
+
+if __name__ == '__main__':
+    main()
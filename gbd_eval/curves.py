@@ -0,0 +1,110 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import numpy as np
+import pandas as pd
+
+from gbd_eval.runtimes import RuntimeMatrix, parse
+
+
+# With cutoff c a run is solved if 0 <= runtime < c (as in penalize), unsolved runs count penalty * c and missing runs
+# are left out (as in nanmean). Between two consecutive distinct runtimes the solved sets are fixed, so PAR-k is linear
+# in c there, and it drops at each runtime. Sorting each solver's runtimes once, prefix sums give the exact scores at all
+# cutoffs, and the linear pieces give the exact points where two solvers swap ranks.
+
+def runtimes(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], max_runtime: int = None):
+    # runtimes at or beyond max_runtime (the limit they were measured with) are unsolved at every cutoff
+    rm = df if isinstance(df, RuntimeMatrix) else None
+    X = rm.columns(solvers) if rm is not None else parse(df, solvers)
+    max_runtime = max_runtime or (rm.max_runtime if rm is not None else None)
+    if max_runtime is None:
+        raise ValueError("PAR-k curves require max_runtime")
+    return X, max_runtime
+
+
+def prefix(X: np.ndarray, max_runtime: float):
+    # per solver: sorted solved runtimes, their prefix sums and the number of runs
+    solved = [ np.sort(x[(x >= 0) & (x < max_runtime)]) for x in X.T ]
+    sums = [ np.concatenate([ [ 0 ], np.cumsum(s) ]) for s in solved ]
+    return solved, sums, (~np.isnan(X)).sum(axis=0)
+
+
+def evaluate(solved: list, sums: list, runs: np.ndarray, cutoffs: np.ndarray, penalty: int = 2, side: str = 'left'):
+    # scores and solved counts at the cutoffs, side 'right' gives the values just above them
+    scores = np.empty((len(cutoffs), len(solved)))
+    counts = np.empty((len(cutoffs), len(solved)), dtype=np.int64)
+    for j, (s, p) in enumerate(zip(solved, sums)):
+        counts[:, j] = np.searchsorted(s, cutoffs, side=side)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scores[:, j] = (p[counts[:, j]] + penalty * cutoffs * (runs[j] - counts[:, j])) / runs[j]
+    return scores, counts
+
+
+def grid(solved: list, max_runtime: float):
+    # all cutoffs at which a solved count changes, and the limit itself
+    return np.unique(np.concatenate(solved + [ [ max_runtime ] ]))
+
+
+def curves(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], max_runtime: int = None, penalty: int = 2, cutoffs: np.ndarray = None):
+    # PAR-k score and solved count of each solver at each cutoff (default: every distinct runtime and max_runtime),
+    # indexed by cutoff with columns ("score", solver) and ("solved", solver)
+    X, max_runtime = runtimes(df, solvers, max_runtime)
+    solved, sums, runs = prefix(X, max_runtime)
+    cutoffs = grid(solved, max_runtime) if cutoffs is None else np.asarray(cutoffs, dtype=np.float64)
+    if (cutoffs > max_runtime).any():
+        raise ValueError("cutoffs beyond max_runtime {}".format(max_runtime))
+    scores, counts = evaluate(solved, sums, runs, cutoffs, penalty)
+    columns = pd.MultiIndex.from_product([ [ "score", "solved" ], solvers ])
+    return pd.DataFrame(np.hstack([ scores, counts ]), index=pd.Index(cutoffs, name="cutoff"), columns=columns).astype({ ("solved", s): np.int64 for s in solvers })
+
+
+def ranks(scores: np.ndarray):
+    order = np.argsort(scores, axis=1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(scores.shape[1]), axis=1)
+    return ranks
+
+
+def flips(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], max_runtime: int = None, penalty: int = 2, block: int = 2**12):
+    # cutoffs at which two solvers swap ranks (by PAR-k, ties by solver order), one row per swap with the overtaking
+    # solver first, 'jump' swaps happen when the cutoff passes a runtime, 'crossing' swaps within a linear piece
+    X, max_runtime = runtimes(df, solvers, max_runtime)
+    solved, sums, runs = prefix(X, max_runtime)
+    cutoffs = grid(solved, max_runtime)
+    rows = []
+    last = None
+    # blocks of alternating states: at c_i, just above c_i, at c_i+1, ..., each block starts with the last state of the previous one
+    for start in range(0, len(cutoffs), block):
+        c = cutoffs[start:start+block]
+        states = np.empty((2 * len(c), len(solvers)))
+        states[0::2] = evaluate(solved, sums, runs, c, penalty)[0]
+        states[1::2] = evaluate(solved, sums, runs, c, penalty, 'right')[0]
+        where, above = np.repeat(c, 2), np.tile([ False, True ], len(c))
+        if last is not None:
+            states, where, above = np.vstack([ last[0], states ]), np.append(last[1], where), np.append(True, above)
+        last = states[-1:], where[-1]
+        R = ranks(np.nan_to_num(states, nan=np.inf))
+        for t in np.flatnonzero((R[1:] != R[:-1]).any(axis=1)):
+            before, after = R[t], R[t + 1]
+            for a, b in zip(*np.nonzero((before[:, None] > before[None, :]) & (after[:, None] < after[None, :]))):
+                if not above[t]:
+                    rows.append((where[t], solvers[a], solvers[b], "jump"))
+                else:
+                    # linear from just above where[t] to the next cutoff
+                    lo, hi = states[t, a] - states[t, b], states[t + 1, a] - states[t + 1, b]
+                    d = where[t + 1] - where[t]
+                    rows.append((where[t] + d * lo / (lo - hi) if lo != hi else where[t], solvers[a], solvers[b], "crossing"))
+    return pd.DataFrame(rows, columns=[ "cutoff", "solver", "overtaken", "kind" ])
@@ -0,0 +1,289 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./gbd-eval watch -t 5000 -o gen/live results.csv
+
+import io
+import os
+import time
+import queue
+import numpy as np
+import pandas as pd
+
+from gbd_eval import tables, trace
+from gbd_eval.portfolio import beam, minima
+from gbd_eval.preprocess import LongFormatReader
+from gbd_eval.util import name
+
+# bytes read from a result file at once
+BLOCK_SIZE = 2**26
+
+# totals kept per group and column: sum of penalized runtimes, number of runs, number of solved runs
+SUM, RUNS, SOLVED = 0, 1, 2
+
+
+class Leaderboard(LongFormatReader):
+
+    # Scores of a running competition, fed with (hash, solver, runtime[, status]) records as they arrive. Each record
+    # changes one cell of the runtime matrix, and the totals of its solver, its instance's family, the instance's VBS
+    # and the tracked portfolios containing the solver are corrected by the change of that cell (O(1), O(k) per portfolio).
+    # A record for a cell that already has a runtime replaces it (reducer 'last') or keeps the smaller one ('min').
+    # The tracked portfolios are the best ones of a beam search, which refresh() runs again on the current matrix.
+    # With families (hash -> family) only records of these instances are counted.
+    def __init__(self, max_runtime: int, penalty: int = 2, reducer: str = "last", families: dict = None, max_k: int = 3, beam_width: int = 10,
+                 solved: list[str] = ["sat", "unsat", "solved", "ok"]):
+        if max_runtime is None:
+            raise ValueError("live scores require max_runtime")
+        if reducer not in ["min", "last"]:
+            raise ValueError("unknown reducer '{}' for live scores".format(reducer))
+        super().__init__(max_runtime, penalty, reducer, solved)
+        self.families = families
+        self.groups = { "all": 0 }
+        self.group = np.zeros(self.values.shape[0], dtype=np.intp)
+        self.best = np.full(self.values.shape[0], np.nan)
+        # column 0 is the VBS, column 1 + c solver c
+        self.totals = np.zeros((3, 1, self.values.shape[1] + 1))
+        self.max_k = max_k
+        self.beam_width = beam_width
+        self.tracked = []
+        self.psums = np.zeros(0)
+        self.pruns = np.zeros(0, dtype=np.int64)
+        self.records = 0
+
+    def reserve(self):
+        rows, cols = self.values.shape
+        super().reserve()
+        if self.values.shape[0] > rows:
+            self.group = np.append(self.group, np.zeros(self.values.shape[0] - rows, dtype=np.intp))
+            self.best = np.append(self.best, np.full(self.values.shape[0] - rows, np.nan))
+        if self.values.shape[1] > cols or len(self.groups) > self.totals.shape[1]:
+            groups = max(self.totals.shape[1], 2 * len(self.groups) if len(self.groups) > self.totals.shape[1] else 0)
+            totals = np.zeros((3, groups, self.values.shape[1] + 1))
+            totals[:, :self.totals.shape[1], :self.totals.shape[2]] = self.totals
+            self.totals = totals
+
+    def account(self, rows: np.ndarray, cols: np.ndarray, old: np.ndarray, new: np.ndarray):
+        # totals of all instances and of the rows' families, by the change of the cells
+        delta = np.stack([ np.nan_to_num(new) - np.nan_to_num(old), ~np.isnan(new) * 1. - ~np.isnan(old), (new < self.max_runtime) * 1. - (old < self.max_runtime) ])
+        for groups in [ np.zeros(len(rows), dtype=np.intp) ] + ([ self.group[rows] ] if self.families is not None else []):
+            for stat in [ SUM, RUNS, SOLVED ]:
+                np.add.at(self.totals[stat], (groups, cols), delta[stat])
+
+    def feed(self, chunk: pd.DataFrame):
+        if self.families is not None:
+            chunk = chunk[chunk["hash"].isin(self.families.keys())]
+        if not len(chunk.index):
+            return self
+        with trace.span("live.feed", rows=len(chunk.index)):
+            runtime = self.runtimes(chunk)
+            hashes = chunk["hash"].to_numpy()
+            known = len(self.rows)
+            r = self.codes(hashes, self.rows)
+            c = self.codes(chunk["solver"].to_numpy(), self.cols)
+            fresh, first = np.unique(r[r >= known], return_index=True)
+            if len(fresh) and self.families is not None:
+                names = [ str(self.families[h]) for h in hashes[r >= known][first] ]
+                codes = np.fromiter((self.groups.setdefault(n, len(self.groups)) for n in names), dtype=np.intp, count=len(names))
+            self.reserve()
+            if len(fresh) and self.families is not None:
+                self.group[fresh] = codes
+
+            # one change per cell: its last record, or its minimum
+            keys = pd.Series((r.astype(np.int64) << 32) | c)
+            if self.reducer == "last":
+                keep = ~keys.duplicated(keep='last').to_numpy()
+                r, c, runtime = r[keep], c[keep], runtime[keep]
+            else:
+                least = pd.Series(runtime).groupby(keys.to_numpy()).min()
+                r, c, runtime = (least.index.to_numpy() >> 32).astype(np.intp), (least.index.to_numpy() & 0xffffffff).astype(np.intp), least.to_numpy()
+            old = self.values[r, c]
+            new = np.fmin(old, runtime) if self.reducer == "min" else runtime
+            rows = np.unique(r)
+            best = self.best[rows]
+            touched = set(np.unique(c).tolist())
+            affected = [ p for p, tup in enumerate(self.tracked) if not touched.isdisjoint(tup) ]
+            before = minima(self.values[rows], [ self.tracked[p] for p in affected ])
+
+            self.values[r, c] = new
+            self.seen[r, c] = True
+            self.account(r, c + 1, old, new)
+            # the VBS only changes where the new runtime is smaller, or where the cell held the minimum and grew
+            np.fmin.at(self.best, r, new)
+            stale = np.unique(r[(old == best[np.searchsorted(rows, r)]) & ~(new <= old)])
+            if len(stale):
+                self.best[stale] = np.fmin.reduce(self.values[stale, :len(self.cols)], axis=1)
+            self.account(rows, np.zeros(len(rows), dtype=np.intp), best, self.best[rows])
+            if affected:
+                after = minima(self.values[rows], [ self.tracked[p] for p in affected ])
+                self.psums[affected] += np.nansum(after, axis=0) - np.nansum(before, axis=0)
+                self.pruns[affected] += (~np.isnan(after)).sum(axis=0) - (~np.isnan(before)).sum(axis=0)
+            self.records += len(chunk.index)
+        return self
+
+    def add(self, hash: str, solver: str, runtime, status: str = None):
+        record = { "hash": [ hash ], "solver": [ solver ], "runtime": [ runtime ] }
+        if status is not None:
+            record["status"] = [ status ]
+        return self.feed(pd.DataFrame(record))
+
+    def solvers(self):
+        return list(self.cols)
+
+    def refresh(self):
+        # beam search on the current matrix for the portfolios to track, their sums are then kept up to date by feed
+        X = self.values[:len(self.rows), :len(self.cols)]
+        with trace.span("live.refresh", max_k=self.max_k, beam_width=self.beam_width).shape(X):
+            levels = beam(X, self.max_k, self.beam_width) if X.shape[0] and X.shape[1] > 1 and self.max_k > 1 else []
+            self.tracked = [ tup for tuples, _ in levels[1:] for tup in tuples ]
+            mins = minima(X, self.tracked)
+            self.psums = np.nansum(mins, axis=0)
+            self.pruns = (~np.isnan(mins)).sum(axis=0)
+        return self
+
+    def scores(self):
+        # score (mean penalized runtime), solved and run counts of the solvers and the VBS, as in the scores command
+        cols = list(range(1, len(self.cols) + 1)) + [ 0 ]
+        sums, runs, solved = self.totals[:, 0, cols]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tab = pd.DataFrame({ "score": sums / runs, "solved": solved.astype(np.int64), "runs": runs.astype(np.int64) }, index=self.solvers() + [ "vbs" ])
+        return tab.sort_values(by="score", ascending=True)
+
+    def family_scores(self):
+        # mean penalized runtime per family, solver and the VBS, with the number of instances, like scores.scores_group_wise
+        names = [ n for n in self.groups if n != "all" ]
+        codes = [ self.groups[n] for n in names ] + [ 0 ]
+        cols = list(range(1, len(self.cols) + 1)) + [ 0 ]
+        sums, runs = self.totals[SUM][np.ix_(codes, cols)], self.totals[RUNS][np.ix_(codes, cols)]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tab = pd.DataFrame(sums / runs, columns=self.solvers() + [ "vbs" ])
+        count = np.bincount(self.group[:len(self.rows)], minlength=self.totals.shape[1])
+        tab.insert(0, "count", np.append(count[codes[:-1]], len(self.rows)))
+        tab.insert(0, "family", names + [ "all" ])
+        return pd.concat([ tab.iloc[:-1].sort_values(by="count", ascending=False, kind='stable'), tab.iloc[-1:] ], ignore_index=True)
+
+    def portfolios(self, n_best: int = 1, rename = lambda s : s):
+        # the best tracked portfolios of each size (k = 1: the best solvers), in the format of Portfolios.get
+        solvers = self.solvers()
+        scores = self.scores().drop("vbs")
+        rows = [ (1, rename(s), score) for s, score in scores["score"].iloc[:n_best].items() ]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self.psums / self.pruns
+        for k in range(2, self.max_k + 1):
+            ranked = sorted((means[p], tup) for p, tup in enumerate(self.tracked) if len(tup) == k)
+            rows.extend((k, ",".join(rename(solvers[i]) for i in tup), score) for score, tup in ranked[:n_best])
+        return pd.DataFrame(rows, columns=[ "k", "portfolio", "score" ])
+
+    def snapshot(self, target: str):
+        # leaderboard files, each replaced at once such that readers never see a partial table
+        os.makedirs(target, exist_ok=True)
+        with trace.span("live.snapshot", target=target, records=self.records):
+            tab = self.scores()
+            replace(os.path.join(target, "scores.tex"), lambda path : tables.scores(tab, to_latex=path))
+            replace(os.path.join(target, "scores.html"), lambda path : tables.scores(tab, to_html=path))
+            replace(os.path.join(target, "portfolios.tex"), lambda path : tables.best_k_portfolios(self.portfolios(rename=name), path))
+            if self.families is not None and len(self.groups) > 1:
+                solvers = self.solvers()
+                replace(os.path.join(target, "families.tex"), lambda path : tables.group_wise_scores(self.family_scores(), solvers + [ "vbs" ], [ "family" ], path, bold_min_of=solvers, min_diff=0))
+        return tab
+
+
+def replace(path: str, write):
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def parse_records(data: bytes, header: bytes = None):
+    # records of complete lines, CSV with the given header line or JSON lines
+    if header is None:
+        return pd.read_json(io.BytesIO(data), lines=True, dtype=False)
+    return pd.read_csv(io.BytesIO(header + data), dtype={ "hash": str, "solver": str })
+
+
+def follow(paths: list[str], poll: float = 1.0, once: bool = False, block: int = BLOCK_SIZE):
+    # chunks of the records appended to growing result files (CSV with header, or .json/.jsonl lines), reading only
+    # what was added since the last look, files that shrink are read again from the start; an empty chunk is
+    # yielded after each look without new records, with once the generator stops there
+    offsets = { path: 0 for path in paths }
+    headers = { path: None for path in paths }
+    while True:
+        found = False
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            if os.path.getsize(path) < offsets[path]:
+                offsets[path], headers[path] = 0, None
+            with open(path, "rb") as f:
+                f.seek(offsets[path])
+                csv = not (path.endswith(".jsonl") or path.endswith(".json"))
+                while True:
+                    data = f.read(block)
+                    end = data.rfind(b"\n") + 1
+                    if not end:
+                        break
+                    data = data[:end]
+                    f.seek(offsets[path] + end)
+                    offsets[path] += end
+                    if csv and headers[path] is None:
+                        line = data.index(b"\n") + 1
+                        headers[path], data = data[:line], data[line:]
+                    if data.strip():
+                        found = True
+                        yield parse_records(data, headers[path] if csv else None)
+        if not found:
+            if once:
+                return
+            yield pd.DataFrame(columns=[ "hash", "solver", "runtime" ])
+            time.sleep(poll)
+
+
+def drain(records: queue.Queue, poll: float = 1.0, batch: int = 2**16):
+    # chunks of the (hash, solver, runtime[, status]) tuples put on a queue, e.g. by a socket server or a test harness,
+    # an empty chunk after poll seconds without records, None ends the stream
+    while True:
+        chunk = []
+        try:
+            chunk.append(records.get(timeout=poll))
+            while chunk[-1] is not None and len(chunk) < batch:
+                chunk.append(records.get_nowait())
+        except queue.Empty:
+            pass
+        done = len(chunk) > 0 and chunk[-1] is None
+        chunk = chunk[:-1] if done else chunk
+        columns = [ "hash", "solver", "runtime", "status" ]
+        yield pd.DataFrame(chunk, columns=columns[:len(chunk[0])] if chunk else columns[:3])
+        if done:
+            return
+
+
+def watch(board: Leaderboard, chunks, target: str, interval: float = 5.0, refresh: float = 60.0):
+    # feeds the chunks to the board, writes a snapshot to target every interval seconds in which records arrived
+    # and searches the tracked portfolios again every refresh seconds, and once more at the end of the stream
+    written, searched, changed = time.monotonic(), -np.inf, False
+    try:
+        for chunk in chunks:
+            if len(chunk.index):
+                board.feed(chunk)
+                changed = True
+            now = time.monotonic()
+            if changed and now - searched >= refresh:
+                board.refresh()
+                searched = now
+            if changed and now - written >= interval:
+                board.snapshot(target)
+                written, changed = now, False
+    finally:
+        if changed or not os.path.exists(os.path.join(target, "scores.tex")):
+            board.refresh().snapshot(target)
+    return board
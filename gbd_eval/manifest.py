@@ -0,0 +1,73 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import os
+import glob
+import json
+import inspect
+
+from gbd_eval.cache import fingerprint, digest
+
+
+def file_digest(path: str):
+    return fingerprint(path, content=True)[-1]
+
+
+_version = None
+
+def code_version():
+    global _version
+    if _version is None:
+        sources = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")))
+        _version = digest([ file_digest(src) for src in sources ])
+    return _version
+
+
+def virtual(output: str):
+    # outputs of the form 'kind:name' are in-memory results, all others are files
+    return ":" in output and not os.path.isabs(output)
+
+
+class Manifest:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.records = json.load(f)
+
+    def key(self, job, upstream: list[str]):
+        inputs = [ (i, file_digest(i)) for i in job.inputs if not virtual(i) and os.path.isfile(i) ]
+        source = inspect.getsourcefile(job.func)
+        return digest([ job.func.__module__, job.func.__qualname__, job.args, job.params, inputs, sorted(upstream),
+                        code_version(), file_digest(source) if source else None ])
+
+    def artifacts(self, job):
+        return [ out for out in job.outputs if not virtual(out) ]
+
+    def fresh(self, job, key: str):
+        artifacts = self.artifacts(job)
+        return len(artifacts) > 0 and all(os.path.exists(out) and self.records.get(out) == key for out in artifacts)
+
+    def record(self, job, key: str):
+        for out in self.artifacts(job):
+            self.records[out] = key
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = "{}.tmp".format(self.path)
+        with open(tmp, "w") as f:
+            json.dump(self.records, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
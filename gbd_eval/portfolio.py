@@ -14,21 +14,221 @@
 
 # run: ./eval.py
 
+import bisect
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from itertools import combinations
-from gbd_eval import tables
+from gbd_eval import tables, trace
 from gbd_eval.util import name
 from gbd_eval.preprocess import DataPreprocessor
+from gbd_eval.runtimes import RuntimeMatrix, nanmean, parse, share, attach
 
-def pscore(df: pd.DataFrame, solvers: list[str]):
+# maximum number of cells in one batched minimum
+BATCH_CELLS = 2**22
+
+
+def pscore(df: pd.DataFrame | RuntimeMatrix, solvers: list[str]):
+    if isinstance(df, RuntimeMatrix):
+        return nanmean(df.vbs(solvers))
     return df[solvers].min(axis=1).mean()
 
-def pscores_all(df: pd.DataFrame, solvers: list[str], k: int):
-    return sorted([ (comb, pscore(df, list(comb))) for comb in combinations(solvers, k) ], key=lambda k : k[1])
+def pscores_all(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], k: int, workers: int = None):
+    X = runtimes(df, solvers)
+    with Workers(X, workers) as pool:
+        return named(*pool.score(list(combinations(range(len(solvers)), k))), solvers)
+
+def pscores_ext(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], tuples: list[tuple[str]], workers: int = None):
+    X = runtimes(df, solvers)
+    index = { s: i for i, s in enumerate(solvers) }
+    with Workers(X, workers) as pool:
+        return named(*pool.extend([ tuple(sorted(index[s] for s in tup)) for tup in tuples ]), solvers)
+
+
+def runtimes(df: pd.DataFrame | RuntimeMatrix, solvers: list[str]):
+    if isinstance(df, RuntimeMatrix):
+        return df.columns(solvers)
+    return parse(df, solvers)
+
+def means(block: np.ndarray):
+    # column-major blocks give each column the same (pairwise) summation as a single vector
+    return nanmean(block, axis=0)
+
+def minima(X: np.ndarray, tuples: list[tuple[int]]):
+    out = np.empty((X.shape[0], len(tuples)), order='F')
+    for j, tup in enumerate(tuples):
+        np.fmin.reduce(X[:, list(tup)], axis=1, out=out[:, j])
+    return out
+
+def scores_of(X: np.ndarray, tuples: list[tuple[int]]):
+    if not len(tuples):
+        return np.empty(0)
+    idx = np.array(tuples, dtype=np.intp)
+    step = max(1, BATCH_CELLS // max(1, X.shape[0]))
+    scores = np.empty(len(idx))
+    for c in range(0, len(idx), step):
+        chunk = idx[c:c+step]
+        block = np.asfortranarray(X[:, chunk[:, 0]])
+        for j in range(1, idx.shape[1]):
+            np.fmin(block, X[:, chunk[:, j]], out=block)
+        scores[c:c+step] = means(block)
+    return scores
+
+def extensions(parents: list[tuple[int]], n: int):
+    # deduplicate extended tuples through their solver bitsets
+    seen = set()
+    pairs = []
+    for p, tup in enumerate(parents):
+        mask = sum(1 << i for i in tup)
+        for s in range(n):
+            if not mask >> s & 1 and mask | 1 << s not in seen:
+                seen.add(mask | 1 << s)
+                pairs.append((p, s))
+    return pairs
+
+def extend(X: np.ndarray, parents: list[tuple[int]], mins: np.ndarray, pairs: list[tuple[int]] = None):
+    pairs = extensions(parents, X.shape[1]) if pairs is None else pairs
+    tuples = [ tuple(sorted(parents[p] + (s,))) for p, s in pairs ]
+    scores = np.empty(len(pairs))
+    if len(pairs):
+        idx = np.array(pairs, dtype=np.intp)
+        step = max(1, BATCH_CELLS // max(1, X.shape[0]))
+        for c in range(0, len(idx), step):
+            chunk = idx[c:c+step]
+            block = np.empty((X.shape[0], len(chunk)), order='F')
+            np.fmin(mins[:, chunk[:, 0]], X[:, chunk[:, 1]], out=block)
+            scores[c:c+step] = means(block)
+    return tuples, scores
+
+def ranked(tuples: list[tuple[int]], scores: np.ndarray, n_best: int = None):
+    order = sorted(range(len(tuples)), key=lambda i : (scores[i], tuples[i]))[:n_best]
+    return [ tuples[i] for i in order ], scores[order]
+
+def named(tuples: list[tuple[int]], scores: np.ndarray, solvers: list[str], n_best: int = None):
+    tuples, scores = ranked(tuples, scores, n_best)
+    return [ (tuple(solvers[i] for i in tup), float(score)) for tup, score in zip(tuples, scores) ]
+
+
+def evaluate(X: np.ndarray, parents: list[tuple[int]], pairs: list[tuple[int]], n_best: int = None):
+    if parents is None:
+        return ranked(pairs, scores_of(X, pairs), n_best)
+    return ranked(*extend(X, parents, minima(X, parents), pairs), n_best)
+
+def merge(results: list, n_best: int = None):
+    # each part holds its own n_best, so the merged n_best (and tie order) equals the serial one
+    tuples = [ tup for part in results for tup in part[0] ]
+    return ranked(tuples, np.concatenate([ part[1] for part in results ] + [ np.empty(0) ]), n_best)
+
+
+_X = None
+_shm = None
+
+def _attach(spec: tuple):
+    global _X, _shm
+    _shm, _X = attach(spec)
+
+def _evaluate(job: tuple):
+    return evaluate(_X, *job)
+
+
+class Workers:
+
+    def __init__(self, X: np.ndarray, workers: int = None):
+        self.X = X
+        self.workers = workers or 1
+        self.pool = None
+        self.shm = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self.shm, spec = share(self.X)
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_attach, initargs=(spec,))
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.shm.close()
+            self.shm.unlink()
+            self.pool = None
+
+    def run(self, parents: list[tuple[int]], candidates: list[tuple[int]], n_best: int = None):
+        if self.pool is None or len(candidates) < 2 * self.workers:
+            return evaluate(self.X, parents, candidates, n_best)
+        step = -(-len(candidates) // (4 * self.workers))
+        jobs = [ (parents, candidates[c:c+step], n_best) for c in range(0, len(candidates), step) ]
+        return merge(list(self.pool.map(_evaluate, jobs)), n_best)
+
+    def score(self, tuples: list[tuple[int]], n_best: int = None):
+        return self.run(None, tuples, n_best)
+
+    def extend(self, parents: list[tuple[int]], n_best: int = None):
+        return self.run(parents, extensions(parents, self.X.shape[1]), n_best)
+
+
+def beam(X: np.ndarray, max_k: int, beam_width: int = 10, workers: int = None):
+    # exhaustive for k <= 2, then extend the best beam_width portfolios of size k-1
+    singles = [ (i,) for i in range(X.shape[1]) ]
+    levels = [ ranked(singles, means(X), beam_width) ]
+    with Workers(X, workers) as pool:
+        parents = singles
+        for k in range(2, max_k + 1):
+            levels.append(pool.extend(parents, beam_width))
+            parents = levels[-1][0]
+    return levels
+
+def optimal(X: np.ndarray, k: int, n_best: int = 1, seed: list[tuple[int]] = []):
+    # branch-and-bound: the VBS over the partial portfolio and all remaining candidates bounds every completion.
+    # Scores are means over the instances a portfolio has runs on (as in beam), so a completion averages the rows of
+    # the partial portfolio plus some rows only the remaining candidates have runs on, and its mean is bounded below
+    # by the smaller of the bound's mean on the partial rows and its minimum on the additional rows.
+    n = X.shape[1]
+    order = np.argsort(means(X), kind='stable')
+    Y = np.asfortranarray(X[:, order])
+    suffix = np.empty((Y.shape[0], n + 1), order='F')
+    suffix[:, n] = np.nan
+    for i in range(n - 1, -1, -1):
+        np.fmin(Y[:, i], suffix[:, i + 1], out=suffix[:, i])
+
+    best = []
+    def push(score, tup):
+        # seeded tuples are found again by the search
+        if any(tup == other for _, other in best):
+            return
+        if len(best) < n_best or (score, tup) < best[-1]:
+            bisect.insort(best, (score, tup))
+            del best[n_best:]
+    def threshold():
+        return best[-1][0] if len(best) == n_best else np.inf
+
+    rank = np.argsort(order)
+    if len(seed):
+        for tup, score in zip(seed, means(minima(Y, [ tuple(rank[i] for i in tup) for tup in seed ]))):
+            push(float(score), tuple(sorted(tup)))
+
+    def branch(start: int, cur: np.ndarray, chosen: list[int]):
+        stop = n - (k - len(chosen)) + 1
+        cand = np.empty((Y.shape[0], stop - start), order='F')
+        np.fmin(cur[:, None], Y[:, start:stop], out=cand)
+        if len(chosen) + 1 == k:
+            scores = means(cand)
+            for j in np.argsort(scores, kind='stable'):
+                if not scores[j] <= threshold():
+                    break
+                push(float(scores[j]), tuple(sorted(int(order[i]) for i in chosen + [start + j])))
+        else:
+            low = np.fmin(cand, suffix[:, start + 1:stop + 1])
+            partial = ~np.isnan(cand)
+            extra = np.where(partial | np.isnan(low), np.inf, low).min(axis=0, initial=np.inf)
+            bounds = np.fmin(means(np.where(partial, low, np.nan)), extra)
+            for j in np.argsort(bounds, kind='stable'):
+                if bounds[j] > threshold():
+                    break
+                branch(start + j + 1, cand[:, j], chosen + [start + j])
+
+    branch(0, np.full(Y.shape[0], np.nan), [])
+    return [ tup for _, tup in best ], np.array([ score for score, _ in best ])
 
-def pscores_ext(df: pd.DataFrame, solvers: list[str], tuples: list[tuple[str]]):
-    tupset = set(frozenset(comb + (s,)) for comb in tuples for s in solvers if s not in comb)
-    return sorted([ (tuple(comb), pscore(df, list(comb))) for comb in tupset ], key=lambda k : k[1])
 
 class Portfolios:
 
@@ -36,15 +236,30 @@ class Portfolios:
         self.gbd = gbd
         self.query = query
         self.solvers = solvers
-        self.df = DataPreprocessor(gbd, query, solvers).numeric(solvers).penalize(solvers, max_runtime).get()
+        self.rm = DataPreprocessor(gbd, query, solvers).matrix(solvers, max_runtime) if gbd is not None else None
         self.pfs = []
         self.max_runtime = max_runtime
 
-    def generate(self, max_k: int = 3, beam_width: int = 10):
-        self.pfs = [ pscores_all(self.df, self.solvers, 1)[:beam_width] ]
-        self.pfs.append(pscores_all(self.df, self.solvers, 2)[:beam_width])
-        for _ in range(3, max_k):
-            self.pfs.append(pscores_ext(self.df, self.solvers, [p[0] for p in self.pfs[-1]])[:beam_width])
+    @staticmethod
+    def from_matrix(rm: RuntimeMatrix | str, solvers: list[str] = None):
+        rm = RuntimeMatrix.open(rm) if isinstance(rm, str) else rm
+        pfgen = Portfolios(None, None, solvers or rm.solvers, rm.max_runtime)
+        pfgen.rm = rm
+        return pfgen
+
+    @property
+    def df(self):
+        return self.rm.to_frame()
+
+    def generate(self, max_k: int = 3, beam_width: int = 10, exact: bool = False, workers: int = None):
+        X = self.rm.columns(self.solvers)
+        with trace.span("portfolio.generate", max_k=max_k, beam_width=beam_width, exact=exact).shape(X):
+            with trace.span("portfolio.beam").shape(X):
+                levels = beam(X, max(2, max_k - 1), beam_width, workers)
+            if exact:
+                with trace.span("portfolio.optimal").shape(X):
+                    levels = levels[:2] + [ optimal(X, k, beam_width, seed=tuples) for k, (tuples, _) in enumerate(levels[2:], 3) ]
+            self.pfs = [ named(tuples, scores, self.solvers) for tuples, scores in levels ]
         return self
     
     def sorted(self):
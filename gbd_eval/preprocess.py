@@ -13,41 +13,231 @@
 # copies or substantial portions of the Software.
 
 from gbd_core.api import GBD
+import numpy as np
 import pandas as pd
 
+from gbd_eval import cache, runtimes, trace
+from gbd_eval.runtimes import RuntimeMatrix
+
 class DataPreprocessor:
 
-    def __init__(self, gbd: GBD, query: str, features: list[str]):
+    # in compact mode hashes are stored as 16 bytes, text columns as categoricals and
+    # runtimes as float32 with status bits (see runtimes.compact), timeouts are decided on the parsed values
+    def __init__(self, gbd: GBD, query: str, features: list[str], cached: bool = True, compact: bool = False):
         self.gbd = gbd
         self.query = query
         self.features = features
-        self.df = gbd.query(query, resolve=features)
+        self.compact = compact
+        self.status = {}
+        self.rm = None
+        self.df = None
+        if gbd is not None:
+            with trace.span("preprocess.query", query=query, cached=cached) as span:
+                self.df = cache.query(gbd, query, features) if cached else gbd.query(query, resolve=features)
+                span.shape(self.df)
+            if compact:
+                self.shrink()
+
+    @staticmethod
+    def from_frame(df: pd.DataFrame, compact: bool = False):
+        data = DataPreprocessor(None, None, df.columns.tolist(), compact=compact)
+        data.df = df
+        if compact:
+            data.shrink()
+        return data
+
+    @staticmethod
+    def from_matrix(rm: RuntimeMatrix | str, compact: bool = False):
+        # a runtime matrix or matrix file, matrix() returns its columns without parsing the frame again
+        rm = RuntimeMatrix.open(rm) if isinstance(rm, str) else rm
+        data = DataPreprocessor.from_frame(rm.to_frame(), compact)
+        data.rm = rm
+        return data
 
     def get(self):
         return self.df
 
+    def hashes(self):
+        hashes = self.df["hash"] if "hash" in self.df.columns else self.df.index
+        return runtimes.hex_hashes(hashes.to_numpy()) if hashes.dtype.kind == "S" else hashes
+
+    def shrink(self):
+        with trace.span("preprocess.shrink", rows=len(self.df.index), cols=len(self.df.columns)):
+            if "hash" in self.df.columns and self.df["hash"].dtype == object:
+                binary = runtimes.binary_hashes(self.df["hash"].to_numpy())
+                if binary is not None:
+                    self.df["hash"] = binary
+            # text columns with repeated values (families, tracks, results) become categoricals,
+            # runtimes are mostly distinct and are compacted by numeric
+            for col in self.df.columns:
+                if col != "hash" and self.df[col].dtype == object:
+                    if self.df[col].nunique() <= len(self.df.index) // 2:
+                        self.df[col] = self.df[col].astype("category")
+        return self
+
+    def matrix(self, columns: list[str], max_runtime: int = None):
+        with trace.span("preprocess.matrix", rows=len(self.df.index), cols=len(columns)):
+            if self.rm is not None and max_runtime == self.rm.max_runtime:
+                return self.rm.select(columns)
+            if not self.compact:
+                return RuntimeMatrix.from_frame(self.df, columns, max_runtime)
+            self.numeric(columns)
+            X = np.empty((len(self.df.index), len(columns)), dtype=np.float32, order='F')
+            for j, col in enumerate(columns):
+                X[:, j] = self.df[col].to_numpy()
+                if max_runtime is not None:
+                    runtimes.penalize_compact(X[:, j], self.status[col].copy(), max_runtime)
+            return RuntimeMatrix(X, self.hashes(), columns, max_runtime)
+
     def numeric(self, columns: list[str]):
-        for name in columns:
-            self.df[name] = pd.to_numeric(self.df[name], errors='coerce')
+        with trace.span("preprocess.numeric", rows=len(self.df.index), cols=len(columns)):
+            if not self.compact:
+                self.df[columns] = runtimes.parse(self.df, columns)
+                return self
+            for col in columns:
+                if col in self.status:
+                    continue
+                if isinstance(self.df[col].dtype, pd.CategoricalDtype):
+                    # each distinct value is parsed once, missing values (code -1) take the appended NaN
+                    uniques = pd.to_numeric(pd.Series(self.df[col].cat.categories, dtype=object), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                    values = np.append(uniques, np.nan)[self.df[col].cat.codes.to_numpy()]
+                else:
+                    values = pd.to_numeric(self.df[col], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                self.df[col], self.status[col] = runtimes.compact(values)
         return self
     
     def penalize(self, columns: list[str], max_runtime: int = 5000):
-        for name in columns:
-            self.df.loc[self.df[name] >= max_runtime, name] = 2*max_runtime
-            self.df.loc[self.df[name] < 0, name] = 2*max_runtime
+        self.rm = None
+        with trace.span("preprocess.penalize", rows=len(self.df.index), cols=len(columns)):
+            if not self.compact:
+                self.df[columns] = runtimes.penalize(runtimes.parse(self.df, columns), max_runtime)
+                return self
+            self.numeric(columns)
+            for col in columns:
+                values = self.df[col].to_numpy(copy=True)
+                runtimes.penalize_compact(values, self.status[col], max_runtime)
+                self.df[col] = values
         return self
 
     def remainder(self, column: str, min_group_size: int = 5, rname: str = "miscellaneous"):
-        small = self.df.groupby(column).count().query("hash < {}".format(min_group_size)).index.tolist()
-        small.extend(["empty", "unknown"])
-        self.df.replace(small, rname, inplace=True)
+        with trace.span("preprocess.remainder", rows=len(self.df.index), cols=1):
+            if isinstance(self.df[column].dtype, pd.CategoricalDtype):
+                # small groups are merged by remapping the category codes, categories stay sorted
+                codes = self.df[column].cat.codes.to_numpy()
+                names = self.df[column].cat.categories
+                small = (np.bincount(codes[codes >= 0], minlength=len(names)) < min_group_size) | names.isin(["empty", "unknown"])
+                categories = names[~small].append(pd.Index([ rname ] if small.any() else [])).unique().sort_values()
+                mapping = np.append(categories.get_indexer(names.where(~small, rname)), -1)
+                self.df[column] = pd.Categorical.from_codes(mapping[codes], categories).remove_unused_categories()
+            else:
+                small = self.df.groupby(column).count().query("hash < {}".format(min_group_size)).index.tolist()
+                small.extend(["empty", "unknown"])
+                self.df.replace(small, rname, inplace=True)
         return self
     
     def vbs(self, columns: list[str]):
-        if set(columns) <= set(self.df.columns):
-            self.df["vbs"] = self.df[columns].min(axis=1)
+        with trace.span("preprocess.vbs", rows=len(self.df.index), cols=len(columns)):
+            if set(columns) <= set(self.df.columns):
+                vbs = np.fmin.reduce(runtimes.parse(self.df, columns), axis=1)
+                self.df["vbs"] = vbs.astype(np.float32) if self.compact else vbs
+            else:
+                data = DataPreprocessor(self.gbd, self.query, columns)
+                vbs = data.numeric(columns).penalize(columns).vbs(columns).get()
+                self.df["vbs"] = vbs["vbs"]
+        return self
+
+
+class LongFormatReader:
+
+    # builds the wide runtime matrix from (hash, solver, runtime[, status]) records in chunks,
+    # duplicate runs are reduced by 'min', 'last' or 'median' (only duplicates are kept aside for the median)
+    def __init__(self, max_runtime: int = None, penalty: int = 2, reducer: str = "min", solved: list[str] = ["sat", "unsat", "solved", "ok"]):
+        if reducer not in ["min", "last", "median"]:
+            raise ValueError("unknown reducer '{}'".format(reducer))
+        self.max_runtime = max_runtime
+        self.penalty = penalty
+        self.reducer = reducer
+        self.solved = set(solved)
+        self.rows = {}
+        self.cols = {}
+        self.values = np.full((1024, 16), np.nan)
+        self.seen = np.zeros((1024, 16), dtype=bool)
+        self.dups = []
+
+    def codes(self, keys, index: dict):
+        return np.fromiter((index.setdefault(k, len(index)) for k in keys), dtype=np.intp, count=len(keys))
+
+    def reserve(self):
+        rows, cols = self.values.shape
+        while rows < len(self.rows):
+            rows *= 2
+        while cols < len(self.cols):
+            cols *= 2
+        if (rows, cols) != self.values.shape:
+            values, seen = np.full((rows, cols), np.nan), np.zeros((rows, cols), dtype=bool)
+            values[:self.values.shape[0], :self.values.shape[1]] = self.values
+            seen[:self.seen.shape[0], :self.seen.shape[1]] = self.seen
+            self.values, self.seen = values, seen
+
+    def runtimes(self, chunk: pd.DataFrame):
+        runtime = pd.to_numeric(chunk["runtime"], errors='coerce').to_numpy(dtype=np.float64)
+        unsolved = np.isnan(runtime)
+        if "status" in chunk.columns:
+            unsolved |= ~chunk["status"].astype(str).str.lower().isin(self.solved).to_numpy()
+        if self.max_runtime is None:
+            runtime[unsolved] = np.nan
+            return runtime
+        runtime[unsolved] = self.max_runtime
+        return runtimes.penalize(runtime, self.max_runtime, self.penalty)
+
+    def feed(self, chunk: pd.DataFrame):
+        runtime = self.runtimes(chunk)
+        r = self.codes(chunk["hash"].to_numpy(), self.rows)
+        c = self.codes(chunk["solver"].to_numpy(), self.cols)
+        self.reserve()
+        if self.reducer == "min":
+            np.fmin.at(self.values, (r, c), runtime)
+        elif self.reducer == "last":
+            # numpy assigns repeated indices in order, so the last record wins
+            self.values[r, c] = runtime
         else:
-            data = DataPreprocessor(self.gbd, self.query, columns)
-            vbs = data.numeric(columns).penalize(columns).vbs(columns).get()
-            self.df["vbs"] = vbs[columns].min(axis=1)
+            dup = pd.Series((r << 32) | c).duplicated().to_numpy() | self.seen[r, c]
+            self.values[r[~dup], c[~dup]] = runtime[~dup]
+            if dup.any():
+                self.dups.append((r[dup], c[dup], runtime[dup]))
+        self.seen[r, c] = True
         return self
+
+    def wide(self):
+        values = self.values[:len(self.rows), :len(self.cols)].copy()
+        if len(self.dups):
+            r, c, v = (np.concatenate(d) for d in zip(*self.dups))
+            cells = r * values.shape[1] + c
+            first = np.unique(cells)
+            cells = np.concatenate([ cells, first ])
+            v = np.concatenate([ v, values.ravel()[first] ])
+            med = pd.Series(v).groupby(cells).median()
+            values.ravel()[med.index.to_numpy()] = med.to_numpy()
+        return values
+
+    def frame(self):
+        df = pd.DataFrame(self.wide(), columns=list(self.cols))
+        df.insert(0, "hash", list(self.rows))
+        return df
+
+    def matrix(self):
+        return RuntimeMatrix(self.wide(), list(self.rows), list(self.cols), self.max_runtime, self.penalty)
+
+
+def read_long(path: str, max_runtime: int = None, penalty: int = 2, reducer: str = "min", chunksize: int = 2**16, solved: list[str] = ["sat", "unsat", "solved", "ok"]):
+    reader = LongFormatReader(max_runtime, penalty, reducer, solved)
+    if path.endswith(".jsonl") or path.endswith(".json"):
+        chunks = pd.read_json(path, lines=True, chunksize=chunksize, dtype=False)
+    else:
+        chunks = pd.read_csv(path, chunksize=chunksize, dtype={ "hash": str, "solver": str })
+    with trace.span("preprocess.read_long", path=path) as span, chunks:
+        for chunk in chunks:
+            reader.feed(chunk)
+        df = reader.frame()
+        span.shape(df)
+    return df
@@ -0,0 +1,252 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+
+
+def parse(df: pd.DataFrame, columns: list[str]):
+    # column-major, such that each solver's runtimes are contiguous
+    values = df[columns].to_numpy()
+    try:
+        return np.asarray(values, dtype=np.float64, order='F')
+    except (ValueError, TypeError):
+        flat = pd.to_numeric(pd.Series(values.ravel(order='F')), errors='coerce')
+        return np.asarray(flat.to_numpy(dtype=np.float64, na_value=np.nan).reshape(values.shape, order='F'), order='F')
+
+def nanmean(values: np.ndarray, axis: int = 0):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nansum(values, axis=axis) / np.count_nonzero(~np.isnan(values), axis=axis)
+
+def penalize(values: np.ndarray, max_runtime: int = 5000, penalty: int = 2):
+    values[(values >= max_runtime) | (values < 0)] = penalty * max_runtime
+    return values
+
+
+# status bits of compact (float32) runtimes
+MISSING = 1
+NEGATIVE = 2
+ROUNDED = 4  # the float32 value is larger than the parsed runtime
+PENALIZED = 8
+
+def compact(values: np.ndarray):
+    single = values.astype(np.float32)
+    status = np.zeros(values.shape, dtype=np.uint8)
+    status[np.isnan(values)] |= MISSING
+    status[values < 0] |= NEGATIVE
+    status[single > values] |= ROUNDED
+    return single, status
+
+def exceeds(values: np.ndarray, status: np.ndarray, limit: float):
+    # values >= limit as decided on the parsed runtimes, for limits representable as float32
+    return (values > limit) | ((values == limit) & (status & ROUNDED == 0))
+
+def penalize_compact(values: np.ndarray, status: np.ndarray, max_runtime: int = 5000, penalty: int = 2):
+    limit = np.float32(max_runtime)
+    if limit != max_runtime or np.float32(penalty * max_runtime) != penalty * max_runtime:
+        raise ValueError("compact runtimes require a float32 representable limit, got {}".format(max_runtime))
+    hit = exceeds(values, status, limit) | (status & NEGATIVE > 0)
+    values[hit] = penalty * max_runtime
+    status[hit] = (status[hit] & ~np.uint8(ROUNDED)) | PENALIZED
+    # runtimes below the limit which float32 rounded onto it are kept below
+    values[~hit & (values >= limit)] = np.nextafter(limit, np.float32(0))
+    return values, status
+
+
+def binary_hashes(hashes: np.ndarray):
+    # 32 digit (lowercase) hex hashes as 16 bytes, None for other hashes
+    text = "".join(hashes) if all(isinstance(h, str) and len(h) == 32 for h in hashes) else None
+    if text is None or text != text.lower():
+        return None
+    try:
+        return np.frombuffer(bytes.fromhex(text), dtype="S16")
+    except ValueError:
+        return None
+
+def hex_hashes(hashes: np.ndarray):
+    text = np.ascontiguousarray(hashes, dtype="S16").tobytes().hex()
+    return np.array([ text[i:i+32] for i in range(0, len(text), 32) ], dtype=object)
+
+
+def mapped(values: np.ndarray):
+    # file and offset of a column-major array viewing a memory-mapped file, None for other arrays
+    base = values
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    if base is None or base.filename is None or base.mode not in [ "r", "readonly" ] or not values.flags.f_contiguous:
+        return None
+    return base.filename, base.offset + values.__array_interface__["data"][0] - base.__array_interface__["data"][0]
+
+
+class Mapped:
+
+    # stands in for the shared memory of arrays that workers map from their (read-only) file
+    def close(self):
+        pass
+
+    def unlink(self):
+        pass
+
+
+def share(values: np.ndarray):
+    source = mapped(values)
+    if source is not None:
+        return Mapped(), (None, values.shape, values.dtype.str) + source
+    shm = shared_memory.SharedMemory(create=True, size=max(1, values.nbytes))
+    array = np.ndarray(values.shape, values.dtype, buffer=shm.buf, order='F')
+    array[...] = values
+    return shm, (shm.name, values.shape, values.dtype.str)
+
+def attach(spec: tuple):
+    name, shape, dtype = spec[:3]
+    if name is None:
+        return Mapped(), np.memmap(spec[3], dtype, "r", spec[4], shape, order='F')
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype, buffer=shm.buf, order='F')
+
+
+# Runtime matrix files: magic, header length (8 bytes, little endian), JSON header (solvers, max_runtime, penalty, sources, dtypes),
+# then at 64 byte aligned offsets the hash index (16 byte binary md5 hashes, or fixed width ASCII) and the column-major runtimes
+MAGIC = b"GBDRTM01"
+ALIGN = 64
+
+def aligned(offset: int):
+    return -(-offset // ALIGN) * ALIGN
+
+
+class RuntimeMatrix:
+
+    def __init__(self, data: np.ndarray, hashes, solvers: list[str], max_runtime: int = None, penalty: int = 2):
+        self.data = np.asarray(data, dtype=np.float64, order='F')
+        # hashes can be given as a function, to decode the index of mapped files on first use
+        self._hashes = hashes if callable(hashes) else pd.Index(hashes, name="hash")
+        self.solvers = list(solvers)
+        self.index = { s: i for i, s in enumerate(self.solvers) }
+        self.max_runtime = max_runtime
+        self.penalty = penalty
+        self._vbs = None
+        self.path = None
+        self.sources = []
+
+    @property
+    def hashes(self):
+        if callable(self._hashes):
+            self._hashes = pd.Index(self._hashes(), name="hash")
+        return self._hashes
+
+    @staticmethod
+    def from_frame(df: pd.DataFrame, solvers: list[str], max_runtime: int = None, penalty: int = 2):
+        rm = RuntimeMatrix(parse(df, solvers), df["hash"] if "hash" in df.columns else df.index, solvers, penalty=penalty)
+        if max_runtime is not None:
+            rm.penalize(max_runtime, penalty)
+        return rm
+
+    def to_frame(self, vbs: bool = False):
+        df = pd.DataFrame(self.data, columns=self.solvers)
+        df.insert(0, "hash", self.hashes.to_numpy())
+        if vbs:
+            df["vbs"] = self.vbs()
+        return df
+
+    def save(self, path: str, sources: list[str] = []):
+        # sources identify the inputs, e.g. database fingerprints or the query
+        binary = binary_hashes(self.hashes.to_numpy())
+        hashes = binary if binary is not None else self.hashes.to_numpy().astype(str).astype("S")
+        header = json.dumps({ "rows": len(self), "solvers": self.solvers, "max_runtime": self.max_runtime, "penalty": self.penalty, "sources": list(sources),
+                              "hashes": "md5" if binary is not None else "ascii", "hash_dtype": hashes.dtype.str, "dtype": self.data.dtype.str }).encode()
+        start = aligned(len(MAGIC) + 8 + len(header))
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+            f.write(bytes(start - f.tell()))
+            f.write(hashes.tobytes())
+            f.write(bytes(aligned(f.tell()) - f.tell()))
+            # the transposed column-major matrix is C-contiguous and written without a copy
+            np.asfortranarray(self.data).T.tofile(f)
+        os.replace(tmp, path)
+        return self
+
+    @staticmethod
+    def open(path: str, mode: str = "r"):
+        # runtimes and hashes are memory-mapped, nothing is read but the header;
+        # read-only matrices are passed to worker processes by path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a runtime matrix file".format(path))
+            size = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(size))
+        rows, cols = header["rows"], len(header["solvers"])
+        start = aligned(len(MAGIC) + 8 + size)
+        offset = aligned(start + rows * np.dtype(header["hash_dtype"]).itemsize)
+        if rows and cols:
+            data = np.memmap(path, header["dtype"], mode, offset, (rows, cols), order='F')
+        else:
+            data = np.empty((rows, cols), dtype=header["dtype"], order='F')
+        def hashes():
+            if not rows:
+                return []
+            values = np.memmap(path, header["hash_dtype"], "r", start, (rows,))
+            return hex_hashes(values) if header["hashes"] == "md5" else values.astype(str).astype(object)
+        rm = RuntimeMatrix(data, hashes, header["solvers"], header["max_runtime"], header["penalty"])
+        rm.path = path if mode == "r" and rows and cols else None
+        rm.sources = header["sources"]
+        return rm
+
+    def __reduce_ex__(self, protocol):
+        if self.path is not None:
+            return (RuntimeMatrix.open, (self.path,))
+        self.hashes
+        return super().__reduce_ex__(protocol)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def penalize(self, max_runtime: int = 5000, penalty: int = 2):
+        penalize(self.data, max_runtime, penalty)
+        self.path = None
+        self.max_runtime = max_runtime
+        self.penalty = penalty
+        self._vbs = None
+        return self
+
+    def columns(self, solvers: list[str]):
+        # all solvers in order of a read-only matrix are the matrix itself (no copy, mapped files stay mapped),
+        # otherwise a copy, such that penalizing a selection does not change this matrix
+        if list(solvers) == self.solvers and not self.data.flags.writeable:
+            return self.data
+        return self.data[:, [ self.index[s] for s in solvers ]]
+
+    def column(self, solver: str):
+        return self.data[:, self.index[solver]]
+
+    def select(self, solvers: list[str]):
+        return RuntimeMatrix(self.columns(solvers), self.hashes, solvers, self.max_runtime, self.penalty)
+
+    def vbs(self, solvers: list[str] = None):
+        if solvers is not None:
+            return np.fmin.reduce(self.columns(solvers), axis=1)
+        if self._vbs is None:
+            self._vbs = np.fmin.reduce(self.data, axis=1)
+        return self._vbs
+
+    def scores(self, vbs: bool = True):
+        tab = pd.Series(nanmean(self.data, axis=0), index=self.solvers)
+        if vbs:
+            tab["vbs"] = nanmean(self.vbs())
+        return tab
@@ -19,7 +19,9 @@ import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from itertools import combinations
 
+from gbd_eval import trace
 from gbd_eval.util import name
 
 
@@ -56,10 +58,20 @@ def depenalize(df: pd.DataFrame, solvers: list[str], max=5000):
         df.loc[df[name] > max, name] = max
     return df
 
-def scatter(df: pd.DataFrame, solver1, solver2, groupcol, title=None, max=5000, legend_separate=None, to_latex=None, logscale=False, print_delta=False):
-    colors = ['#113377','#e41a1c','#377eb8','#4daf4a','#984ea3','#ff7f00','#a65628']
-    markers = [ '1', 'x', '*', '+', '.' ]
-    fig, ax = plt.subplots(figsize=(3.5,3.5))
+def partition(labels):
+    # group positions from a single sort on the group codes
+    codes, groups = pd.factorize(np.asarray(labels), sort=True)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(groups) + 1))
+    return groups, codes, order, bounds
+
+def group_means(values: np.ndarray, codes: np.ndarray, n: int):
+    valid = ~np.isnan(values) & (codes >= 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.bincount(codes[valid], values[valid], n) / np.bincount(codes[valid], minlength=n)
+
+def plt_scatter_axes(ax, solver1, solver2, max=5000, logscale=False):
+    plt.sca(ax)
     plt_decorate_scatter_area(min=0, max=max)
     ax.tick_params(axis='both', which='major', labelsize=8)
     ax.tick_params(axis='both', which='minor', labelsize=6)
@@ -76,34 +88,73 @@ def scatter(df: pd.DataFrame, solver1, solver2, groupcol, title=None, max=5000,
     ax.spines['bottom'].set_visible(False)
     ax.spines['left'].set_visible(False)
 
-    # sort group by score difference
-    gf = df.groupby(groupcol).mean(numeric_only=True).reset_index()
-    gf["diff"] = gf[solver1] - gf[solver2]
-    gf["adiff"] = gf["diff"].abs()
-    gf.sort_values(by='adiff', ascending=False, inplace=True)
+def draw_scatter(ax, x: np.ndarray, y: np.ndarray, part: tuple, max=5000, logscale=False, print_delta=False):
+    colors = ['#113377','#e41a1c','#377eb8','#4daf4a','#984ea3','#ff7f00','#a65628']
+    markers = [ '1', 'x', '*', '+', '.' ]
+    groups, codes, order, bounds = part
 
-    df = depenalize(df.copy(), [solver1, solver2], max)
+    # sort group by score difference
+    diff = group_means(x, codes, len(groups)) - group_means(y, codes, len(groups))
+    ranking = np.argsort(-np.abs(diff), kind='stable')
 
-    for i, group in enumerate(gf[groupcol], 0):
+    x, y = np.minimum(x, max), np.minimum(y, max)
+    for i, g in enumerate(ranking, 0):
         m = markers[i % len(markers)]
         c = colors[i % len(colors)]
-        fdf = df.loc[df[groupcol] == group]
-        gdelta = "{:.2f}".format(gf.loc[gf[groupcol] == group]["diff"].values[0])
-        title = name(group)
+        idx = order[bounds[g]:bounds[g + 1]]
+        title = name(groups[g])
         if print_delta:
-            title = title + " ($\Delta_{xy}=$" + gdelta + ")"
-        ax.scatter(fdf[solver1], fdf[solver2], color=c, marker=m, s=30, alpha=.7, linewidth=.7, zorder=i, label=title)
+            title = title + " ($\\Delta_{xy}=$" + "{:.2f}".format(diff[g]) + ")"
+        ax.scatter(x[idx], y[idx], color=c, marker=m, s=30, alpha=.7, linewidth=.7, zorder=i, label=title)
+
+def draw_density(ax, x: np.ndarray, y: np.ndarray, max=5000, logscale=False, gridsize=60):
+    x, y = np.minimum(x, max), np.minimum(y, max)
+    keep = np.isfinite(x) & np.isfinite(y)
+    if logscale:
+        keep &= (x > 0) & (y > 0)
+    scale = 'log' if logscale else 'linear'
+    ax.hexbin(x[keep], y[keep], gridsize=gridsize, xscale=scale, yscale=scale, bins='log', mincnt=1, cmap='Blues', linewidths=0, zorder=1)
 
+def render(fig, ax, legend_separate=None, to_latex=None):
     ax.set_aspect('equal', 'box')
-    lege = ax.legend(loc='center left', bbox_to_anchor=(1.0, .5), ncol=1, frameon=False, fontsize='xx-small', borderaxespad=0, columnspacing=0, labelspacing=.3)
-    
-    if legend_separate is not None:
-        export_legend(lege, legend_separate)
-        lege.remove()
+    if len(ax.get_legend_handles_labels()[0]):
+        lege = ax.legend(loc='center left', bbox_to_anchor=(1.0, .5), ncol=1, frameon=False, fontsize='xx-small', borderaxespad=0, columnspacing=0, labelspacing=.3)
+        if legend_separate is not None:
+            export_legend(lege, legend_separate)
+            lege.remove()
 
     if to_latex is None:
         plt.show()
     else:
-        plt.savefig(to_latex, bbox_inches='tight', pad_inches=0.1)
+        with trace.span("scatter.savefig", artifact=to_latex):
+            fig.savefig(to_latex, bbox_inches='tight', pad_inches=0.1)
 
-    plt.close()
\ No newline at end of file
+@trace.traced("scatter.scatter")
+def scatter(df: pd.DataFrame, solver1, solver2, groupcol, title=None, max=5000, legend_separate=None, to_latex=None, logscale=False, print_delta=False, density=False, gridsize=60):
+    trace.current().set(rows=len(df.index), cols=2, density=density)
+    fig, ax = plt.subplots(figsize=(3.5,3.5))
+    plt_scatter_axes(ax, solver1, solver2, max, logscale)
+    x, y = df[solver1].to_numpy(dtype=float), df[solver2].to_numpy(dtype=float)
+    if density:
+        draw_density(ax, x, y, max, logscale, gridsize)
+    else:
+        draw_scatter(ax, x, y, partition(df[groupcol]), max, logscale, print_delta)
+    render(fig, ax, legend_separate, to_latex)
+    plt.close(fig)
+
+@trace.traced("scatter.scatter_pairs")
+def scatter_pairs(df: pd.DataFrame, solvers: list[str], groupcol, to_latex: str, max=5000, logscale=False, print_delta=False, density=False, gridsize=60):
+    # renders all solver pairs into one reused figure, to_latex is formatted with the pair, e.g. "{}_vs_{}.pdf"
+    trace.current().set(rows=len(df.index), cols=len(solvers), density=density)
+    fig, ax = plt.subplots(figsize=(3.5,3.5))
+    part = partition(df[groupcol]) if not density else None
+    for solver1, solver2 in combinations(solvers, 2):
+        ax.clear()
+        plt_scatter_axes(ax, solver1, solver2, max, logscale)
+        x, y = df[solver1].to_numpy(dtype=float), df[solver2].to_numpy(dtype=float)
+        if density:
+            draw_density(ax, x, y, max, logscale, gridsize)
+        else:
+            draw_scatter(ax, x, y, part, max, logscale, print_delta)
+        render(fig, ax, to_latex=to_latex.format(solver1, solver2))
+    plt.close(fig)
@@ -0,0 +1,182 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import numpy as np
+import pandas as pd
+from itertools import permutations
+
+from gbd_eval.runtimes import RuntimeMatrix
+
+
+# A sequential schedule runs solvers one after another, each with a time slice, within the timeout:
+# an instance is solved by the first slot whose solver needs at most its slice, at the time the slot
+# started plus that runtime. Slots are (solver index, slice) pairs.
+
+def runtimes(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], max_runtime: int = None, penalty: int = 2):
+    rm = df if isinstance(df, RuntimeMatrix) else RuntimeMatrix.from_frame(df, solvers, max_runtime, penalty)
+    timeout = max_runtime or rm.max_runtime
+    if timeout is None:
+        raise ValueError("a schedule requires max_runtime")
+    X = rm.columns(solvers)
+    # instances without runs are not part of the track, missing runs of the others count as unsolved
+    X = np.nan_to_num(X[~np.isnan(X).all(axis=1)], nan=np.inf)
+    X[X > timeout] = np.inf
+    return np.asfortranarray(X), timeout
+
+
+def evaluate(X: np.ndarray, slots: list[tuple], timeout: float, penalty: int = 2):
+    # solved count and PAR-k score of the schedule
+    times = np.full(X.shape[0], np.inf)
+    start = 0
+    for j, t in slots:
+        new = np.isinf(times) & (X[:, j] <= t)
+        times[new] = start + X[new, j]
+        start += t
+    solved = np.isfinite(times)
+    return int(solved.sum()), float(np.where(solved, times, penalty * timeout).mean())
+
+
+class Sorted:
+
+    # per solver runtimes sorted once, slices are evaluated as prefix counts of still unsolved instances
+    def __init__(self, X: np.ndarray):
+        self.order = np.argsort(X, axis=0, kind='stable')
+        self.S = np.take_along_axis(X, self.order, axis=0)
+
+    def candidates(self, unsolved: np.ndarray, budget: float, used: list[int], n_best: int = 1, min_slice: float = 0):
+        # the slices of at least min_slice with the most newly solved instances per second, as (solver, slice, gain)
+        gains = np.cumsum(unsolved[self.order], axis=0)
+        ok = (self.S <= budget) & (self.S >= min_slice) & (gains > 0)
+        ok[:, used] = False
+        with np.errstate(divide='ignore'):
+            ratio = np.where(ok, gains / np.maximum(self.S, 1e-9), -1).ravel(order='F')
+        n_best = min(n_best, int((ratio >= 0).sum()))
+        if n_best == 0:
+            return []
+        best = np.argpartition(-ratio, n_best - 1)[:n_best]
+        best = best[np.argsort(-ratio[best], kind='stable')]
+        rows, cols = np.unravel_index(best, self.S.shape, order='F')
+        return [ (int(j), float(self.S[i, j]), int(gains[i, j])) for i, j in zip(rows, cols) ]
+
+
+def objective(X: np.ndarray, slots: list[tuple], timeout: float, penalty: int, target: str):
+    # partial schedules are compared as if they ended with their last slot running until the timeout
+    slots = fill(X, slots, timeout)
+    solved, score = evaluate(X, slots, timeout, penalty)
+    used = sum(t for _, t in slots)
+    return (-solved, used) if target == "solved" else (score, -solved)
+
+
+def fill(X: np.ndarray, slots: list[tuple], timeout: float):
+    # the remaining budget goes to the last slot, which can only solve more instances
+    if len(slots):
+        j, t = slots[-1]
+        slots = slots[:-1] + [ (j, t + timeout - sum(t for _, t in slots)) ]
+    return slots
+
+
+def beam(X: np.ndarray, timeout: float, target: str = "solved", beam_width: int = 1, max_slots: int = None, penalty: int = 2):
+    # greedy for beam_width 1: repeatedly add the slot solving most new instances per second of its slice;
+    # a slice gets at least an equal share of the remaining budget among the remaining slots, as each solver runs
+    # once and tiny slices that solve a few trivial instances would use up the solvers, and the result is never
+    # worse than the best single solver running until the timeout
+    srt = Sorted(X)
+    max_slots = min(max_slots or X.shape[1], X.shape[1])
+    states = [ ([], np.ones(X.shape[0], dtype=bool)) ]
+    best = min(([ (j, timeout) ] for j in range(X.shape[1])), key=lambda slots : objective(X, slots, timeout, penalty, target), default=[])
+    for k in range(max_slots):
+        children = {}
+        for slots, unsolved in states:
+            budget = timeout - sum(t for _, t in slots)
+            for j, t, _ in srt.candidates(unsolved, budget, [ s for s, _ in slots ], beam_width, budget / (max_slots - k)):
+                child = slots + [ (j, t) ]
+                children.setdefault(tuple(child), (child, unsolved & ~(X[:, j] <= t)))
+        if not children:
+            break
+        ranked = sorted(children.values(), key=lambda state : objective(X, state[0], timeout, penalty, target))
+        states = ranked[:beam_width]
+        if not best or objective(X, states[0][0], timeout, penalty, target) < objective(X, best, timeout, penalty, target):
+            best = states[0][0]
+    return fill(X, best, timeout)
+
+
+def exact(X: np.ndarray, timeout: float, target: str = "solved", max_slots: int = None, candidates: int = 20, penalty: int = 2):
+    # integer program over candidate slices (up to 'candidates' runtime quantiles per solver) maximizing the solved count,
+    # ties are broken by less time used; the order of the chosen slots is then optimized for PAR-k
+    # (exhaustively for up to 7 slots, otherwise by solved instances per second)
+    from scipy.optimize import milp, LinearConstraint, Bounds
+    from scipy.sparse import csr_matrix, coo_matrix, eye, hstack
+    if target != "solved":
+        raise ValueError("exact schedules maximize the solved count, target '{}' is not supported".format(target))
+    slices = []
+    for j in range(X.shape[1]):
+        values = np.unique(X[np.isfinite(X[:, j]), j])
+        if len(values) > candidates:
+            values = values[np.unique(np.linspace(0, len(values) - 1, candidates).round().astype(int))]
+        slices.extend((j, float(t)) for t in values)
+    if not slices:
+        return []
+    solver = np.array([ j for j, _ in slices ])
+    length = np.array([ t for _, t in slices ])
+    # sparse instance x slice incidence, restricted to the instances any slice solves
+    hits = [ np.flatnonzero(X[:, j] <= t) for j, t in slices ]
+    rows = np.concatenate(hits)
+    cols = np.repeat(np.arange(len(slices)), [ len(h) for h in hits ])
+    solvable, rows = np.unique(rows, return_inverse=True)
+    ny, nz = len(slices), len(solvable)
+    covers = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(nz, ny))
+    # variables: one binary per candidate slice, then one per solvable instance
+    cost = np.concatenate([ length * .5 / timeout, -np.ones(nz) ])
+    one_per_solver = csr_matrix((np.ones(ny), (solver, np.arange(ny))), shape=(X.shape[1], ny + nz))
+    budget = csr_matrix(np.concatenate([ length, np.zeros(nz) ])[None, :])
+    count = csr_matrix(np.concatenate([ np.ones(ny), np.zeros(nz) ])[None, :])
+    link = hstack([ -covers, eye(nz) ], format='csr')
+    constraints = [ LinearConstraint(one_per_solver, -np.inf, 1), LinearConstraint(budget, -np.inf, timeout), LinearConstraint(link, -np.inf, 0) ]
+    if max_slots is not None:
+        constraints.append(LinearConstraint(count, -np.inf, max_slots))
+    res = milp(cost, constraints=constraints, integrality=np.ones(ny + nz), bounds=Bounds(0, 1))
+    if res.x is None:
+        raise ValueError("schedule optimization failed: {}".format(res.message))
+    chosen = [ slices[i] for i in np.flatnonzero(res.x[:ny] > .5) ]
+    if len(chosen) <= 7:
+        order = min(permutations(chosen), key=lambda slots : evaluate(X, list(slots), timeout, penalty)[1])
+    else:
+        order = sorted(chosen, key=lambda slot : -(X[:, slot[0]] <= slot[1]).sum() / max(slot[1], 1e-9))
+    return fill(X, list(order), timeout)
+
+
+def schedule(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], max_runtime: int = None, target: str = "solved", mode: str = "greedy",
+             beam_width: int = 10, max_slots: int = None, candidates: int = 20, penalty: int = 2):
+    # one row per slot with the solved count and PAR-k score of the schedule up to that slot
+    if target not in [ "solved", "par2" ]:
+        raise ValueError("unknown target '{}'".format(target))
+    X, timeout = runtimes(df, solvers, max_runtime, penalty)
+    if mode == "greedy":
+        slots = beam(X, timeout, target, 1, max_slots, penalty)
+    elif mode == "beam":
+        slots = beam(X, timeout, target, beam_width, max_slots, penalty)
+    elif mode == "exact":
+        slots = exact(X, timeout, target, max_slots, candidates, penalty)
+    else:
+        raise ValueError("unknown mode '{}'".format(mode))
+    rows = []
+    start = 0
+    for k in range(1, len(slots) + 1):
+        j, t = slots[k - 1]
+        solved, score = evaluate(X, slots[:k], timeout, penalty)
+        rows.append({ "slot": k, "solver": solvers[j], "start": start, "slice": t, "solved": solved, "score": score })
+        start += t
+    return pd.DataFrame(rows, columns=[ "slot", "solver", "start", "slice", "solved", "score" ])
@@ -0,0 +1,187 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from gbd_eval import trace
+from gbd_eval.manifest import Manifest
+from gbd_eval.util import eprint
+
+
+class Job:
+
+    # a job depends on every job that lists one of its inputs as output,
+    # with pass_inputs the producers' results are appended to args
+    def __init__(self, name: str, func, args: tuple = (), inputs: list[str] = [], outputs: list[str] = [], pass_inputs: bool = False, params: dict = {}):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.pass_inputs = pass_inputs
+        self.params = dict(params)
+
+
+class JobFailed(Exception):
+
+    def __init__(self, failed: dict):
+        super().__init__("failed jobs: {}".format(", ".join(failed.keys())))
+        self.failed = failed
+
+
+def headless():
+    try:
+        import matplotlib
+        matplotlib.use("Agg", force=True)
+    except ImportError:
+        pass
+
+def execute(func, args: tuple, name: str = None):
+    start = time.perf_counter()
+    with trace.span(name or func.__qualname__):
+        result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class Scheduler:
+
+    def __init__(self, jobs: list[Job], n_jobs: int = 1, keep_going: bool = False, manifest: Manifest = None, force: bool = False, dry_run: bool = False):
+        names = [ job.name for job in jobs ]
+        if len(set(names)) < len(names):
+            raise ValueError("duplicate job names")
+        self.jobs = jobs
+        self.n_jobs = n_jobs
+        self.keep_going = keep_going
+        self.producer = { out: job.name for job in jobs for out in job.outputs }
+        self.deps = { job.name: { self.producer[i] for i in job.inputs if i in self.producer and self.producer[i] != job.name } for job in jobs }
+        self.manifest = manifest
+        self.force = force
+        self.dry_run = dry_run
+        self.keys = {}
+        self.results = {}
+        self.timings = {}
+        self.failed = {}
+        self.skipped = []
+        self.fresh = []
+
+    def arguments(self, job: Job):
+        if not job.pass_inputs:
+            return job.args
+        return job.args + tuple(self.results[self.producer[i]] for i in job.inputs if i in self.producer)
+
+    def ready(self, pending: list[Job]):
+        ready = []
+        for job in list(pending):
+            deps = self.deps[job.name]
+            if deps & (self.failed.keys() | set(self.skipped)):
+                pending.remove(job)
+                self.skipped.append(job.name)
+            elif deps <= self.results.keys():
+                pending.remove(job)
+                ready.append(job)
+        return ready
+
+    def order(self):
+        order, done = [], set()
+        while len(order) < len(self.jobs):
+            ready = [ job for job in self.jobs if job.name not in done and self.deps[job.name] <= done ]
+            if not ready:
+                raise ValueError("cyclic job dependencies: {}".format([ job.name for job in self.jobs if job.name not in done ]))
+            order.extend(ready)
+            done.update(job.name for job in ready)
+        return order
+
+    def needed(self):
+        # stale artifacts and everything upstream of them, in dependency order
+        order = self.order()
+        if self.manifest is None:
+            return order
+        for job in order:
+            self.keys[job.name] = self.manifest.key(job, [ self.keys[dep] for dep in self.deps[job.name] ])
+        if self.force:
+            return order
+        needed = set()
+        for job in reversed(order):
+            if job.name in needed or (len(self.manifest.artifacts(job)) and not self.manifest.fresh(job, self.keys[job.name])):
+                needed.add(job.name)
+                needed.update(self.deps[job.name])
+        self.fresh = [ job.name for job in order if job.name not in needed ]
+        return [ job for job in order if job.name in needed ]
+
+    def finish(self, job: Job, outcome):
+        try:
+            self.results[job.name], self.timings[job.name] = outcome()
+        except Exception as e:
+            self.failed[job.name] = e
+            eprint("Job {} failed: {!r}".format(job.name, e))
+            if not self.keep_going:
+                raise
+        else:
+            if self.manifest is not None:
+                self.manifest.record(job, self.keys[job.name])
+
+    def run(self):
+        pending = self.needed()
+        if self.dry_run:
+            for job in pending:
+                print("would run {}{}".format(job.name, "".join(" -> {}".format(out) for out in self.manifest.artifacts(job)) if self.manifest else ""))
+            return self.results
+        self.start = time.perf_counter()
+        headless()
+        try:
+            if self.n_jobs > 1:
+                self.run_pool(pending)
+            else:
+                while pending:
+                    ready = self.ready(pending)
+                    if not ready and pending:
+                        raise ValueError("unsatisfiable job dependencies: {}".format([ job.name for job in pending ]))
+                    for job in ready:
+                        self.finish(job, lambda: execute(job.func, self.arguments(job), job.name))
+        finally:
+            self.summary()
+        if len(self.failed):
+            raise JobFailed(self.failed)
+        return self.results
+
+    def run_pool(self, pending: list[Job]):
+        running = {}
+        with ProcessPoolExecutor(self.n_jobs, initializer=headless) as pool:
+            try:
+                while pending or running:
+                    for job in self.ready(pending):
+                        running[pool.submit(execute, job.func, self.arguments(job), job.name)] = job
+                    if not running:
+                        raise ValueError("unsatisfiable job dependencies: {}".format([ job.name for job in pending ]))
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.finish(running.pop(future), future.result)
+            except BaseException:
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise
+
+    def summary(self):
+        eprint("{:<48} {:>8} {:>10}".format("job", "status", "seconds"))
+        for job in sorted(self.jobs, key=lambda job : -self.timings.get(job.name, 0)):
+            status = "ok" if job.name in self.timings else "failed" if job.name in self.failed else "skipped" if job.name in self.skipped else "fresh" if job.name in self.fresh else "pending"
+            eprint("{:<48} {:>8} {:>10.2f}".format(job.name, status, self.timings.get(job.name, 0)))
+        eprint("{:<48} {:>8} {:>10.2f}".format("sum of jobs", "", sum(self.timings.values())))
+        eprint("{:<48} {:>8} {:>10.2f}".format("wall time", "", time.perf_counter() - self.start))
+
+
+def run(jobs: list[Job], n_jobs: int = 1, keep_going: bool = False, manifest: Manifest = None, force: bool = False, dry_run: bool = False):
+    return Scheduler(jobs, n_jobs, keep_going, manifest, force, dry_run).run()
@@ -14,29 +14,108 @@
 
 # run: ./eval.py
 
+import numpy as np
 import pandas as pd
 
+from gbd_eval.runtimes import RuntimeMatrix, parse
 
-def scores(df: pd.DataFrame):
+
+def scores(df: pd.DataFrame | RuntimeMatrix | str):
+    if isinstance(df, str):
+        df = RuntimeMatrix.open(df)
+    if isinstance(df, RuntimeMatrix):
+        return df.scores().to_frame("score")
     return df.mean(numeric_only=True).to_frame("score")
 
     
+def encode(df: pd.DataFrame, groups: list[str]):
+    # one code per row for the (multi-)key, groups ordered by key, -1 for rows with missing keys
+    codes, uniques = zip(*[ pd.factorize(df[col], sort=True) for col in groups ])
+    codes = np.stack(codes)
+    valid = (codes >= 0).all(axis=0)
+    combined = np.full(len(df.index), -1, dtype=np.int64)
+    keys, combined[valid] = np.unique(np.ravel_multi_index(codes[:, valid], [ len(u) for u in uniques ]), return_inverse=True)
+    keys = np.unravel_index(keys, [ len(u) for u in uniques ])
+    return combined, pd.DataFrame({ col: np.asarray(u)[k] for col, u, k in zip(groups, uniques, keys) })
+
+
+def medians(Xs: np.ndarray, starts: np.ndarray, nums: np.ndarray):
+    # groups are contiguous, sorting each group's block puts NaNs last
+    cols = np.arange(Xs.shape[1])
+    out = np.full((len(starts), Xs.shape[1]), np.nan)
+    for g, (s, e) in enumerate(zip(starts, np.append(starts[1:], len(Xs)))):
+        block = np.sort(Xs[s:e], axis=0)
+        n = nums[g]
+        ok = n > 0
+        out[g, ok] = (block[(n[ok] - 1) // 2, cols[ok]] + block[n[ok] // 2, cols[ok]]) / 2
+    return out
+
+
+def aggregate(df: pd.DataFrame, columns: list[str], groups: list[str], stats: list[str] = ["mean"], max_runtime: int = None, totals: bool = True, vbs: str = "vbs"):
+    # statistics per group and solver column from a single sort on the group codes;
+    # "mean" keeps the column names, other statistics are suffixed with _<stat>
+    for stat in stats:
+        if stat not in ["mean", "solved", "median", "gap"]:
+            raise ValueError("unknown statistic '{}'".format(stat))
+    if "solved" in stats and max_runtime is None:
+        raise ValueError("statistic 'solved' requires max_runtime")
+    codes, tab = encode(df, groups)
+    X = parse(df, columns)
+    if "gap" in stats:
+        X = np.column_stack([ X, parse(df, [ vbs ])[:, 0] if vbs in df.columns else np.fmin.reduce(X, axis=1) ])
+
+    keyed = codes >= 0
+    rows = np.flatnonzero(keyed)[np.argsort(codes[keyed], kind='stable')]
+    Xs = np.asfortranarray(X[rows])
+    starts = np.searchsorted(codes[rows], np.arange(len(tab.index)))
+    valid = ~np.isnan(Xs)
+    sums = np.add.reduceat(np.where(valid, Xs, 0), starts, axis=0) if len(Xs) else np.zeros((0, X.shape[1]))
+    nums = np.add.reduceat(valid, starts, axis=0) if len(Xs) else np.zeros((0, X.shape[1]))
+    tab["count"] = np.diff(np.append(starts, len(Xs)))
+
+    rest = X[~keyed]
+    blocks = []
+    overall = { stat: [] for stat in stats }
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / nums
+        total = (sums.sum(axis=0) + np.nansum(rest, axis=0)) / (nums.sum(axis=0) + (~np.isnan(rest)).sum(axis=0))
+    for stat in stats:
+        if stat == "mean":
+            values, all = mean, total
+        elif stat == "solved":
+            solved = Xs < max_runtime
+            values = np.add.reduceat(solved, starts, axis=0) if len(Xs) else np.zeros((0, X.shape[1]))
+            all = values.sum(axis=0) + (rest < max_runtime).sum(axis=0)
+        elif stat == "median":
+            values = medians(Xs, starts, nums)
+            all = medians(X, np.zeros(1, dtype=np.intp), (~np.isnan(X)).sum(axis=0, keepdims=True))[0]
+        else:
+            values, all = mean - mean[:, -1:], total - total[-1]
+        suffix = "" if stat == "mean" else "_{}".format(stat)
+        blocks.append(pd.DataFrame(values[:, :len(columns)], columns=[ col + suffix for col in columns ]))
+        overall[stat].extend(all[:len(columns)])
+    tab = pd.concat([ tab ] + blocks, axis=1)
+
+    if totals:
+        all = { col: "all" for col in groups }
+        all["count"] = len(df.index)
+        for stat in stats:
+            suffix = "" if stat == "mean" else "_{}".format(stat)
+            all.update({ col + suffix: val for col, val in zip(columns, overall[stat]) })
+        tab = pd.concat([ tab, pd.DataFrame([ all ]) ], ignore_index=True)
+    return tab
+
+
 def scores_group_wise(df: pd.DataFrame, solvers: list[str], groups: list[str], sortby: str = "count"):
-    #group:
-    counts = df.groupby('family').count()["hash"].rename("count")
-    groups = df.groupby('family').mean(numeric_only=True)
-    tab = groups.merge(counts, on='family', how='left')
-    tab.reset_index(inplace=True)
+    tab = aggregate(df, solvers + ["vbs"], groups, ["mean"])
+    tab, all = tab.iloc[:-1].copy(), tab.iloc[-1:]
     #reorder:
     tab["diff"] = tab[solvers].max(axis=1) - tab[solvers].min(axis=1)
     tab["quot"] = tab[solvers].max(axis=1) / tab[solvers].min(axis=1)
     tab["diff2"] = tab[solvers].median(axis=1) - tab[solvers].min(axis=1)
     tab["quot2"] = tab[solvers].median(axis=1) / tab[solvers].min(axis=1)
     tab.sort_values(by=sortby, ascending=False, inplace=True)
-    tab = tab[["family", "count"] + solvers + ["vbs"]]
+    tab = tab[groups + ["count"] + solvers + ["vbs"]]
     #add all:
-    all = scores(df).transpose()
-    all["family"] = "all"
-    all["count"] = len(df.index)    
     tab = pd.concat([tab, all], ignore_index=True)
-    return tab
\ No newline at end of file
+    return tab
@@ -0,0 +1,170 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import os
+import numpy as np
+import pandas as pd
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+
+from gbd_eval import cache
+from gbd_eval.cache import digest, save_columns, load_columns
+from gbd_eval.preprocess import DataPreprocessor
+from gbd_eval.runtimes import RuntimeMatrix, parse, share, attach
+
+SELECTORS = [ "classification", "regression", "cost" ]
+
+
+def estimator(kind: str, params: dict = {}):
+    # scikit-learn is only needed for selection, hence imported on use
+    from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+    params = { "n_estimators": 100, "n_jobs": 1, **params }
+    return RandomForestClassifier(**params) if kind == "classifier" else RandomForestRegressor(**params)
+
+
+def select(selector: str, F: np.ndarray, X: np.ndarray, train: np.ndarray, test: np.ndarray, params: dict = {}):
+    # index of the selected solver for each test instance
+    Ftr, Xtr = F[train], X[train]
+    if selector == "classification" or selector == "cost":
+        # cost-sensitive: instances are weighted by the regret of choosing the worst solver
+        best = np.argmin(Xtr, axis=1)
+        weight = Xtr.max(axis=1) - Xtr.min(axis=1) if selector == "cost" else None
+        if len(np.unique(best)) == 1:
+            return np.full(len(test), best[0])
+        model = estimator("classifier", params).fit(Ftr, best, sample_weight=weight)
+        return model.classes_[np.argmax(model.predict_proba(F[test]), axis=1)]
+    if selector == "regression":
+        # pairwise regression: one model per solver pair predicts the log-runtime difference,
+        # the selected solver has the smallest sum of predicted differences to all others
+        L = np.log1p(Xtr)
+        total = np.zeros((len(test), X.shape[1]))
+        for i, j in combinations(range(X.shape[1]), 2):
+            delta = estimator("regressor", params).fit(Ftr, L[:, i] - L[:, j]).predict(F[test])
+            total[:, i] += delta
+            total[:, j] -= delta
+        return np.argmin(total, axis=1)
+    raise ValueError("unknown selector '{}'".format(selector))
+
+
+_F = None
+_X = None
+_shm = []
+
+def _attach(fspec: tuple, xspec: tuple):
+    global _F, _X, _shm
+    (fshm, _F), (xshm, _X) = attach(fspec), attach(xspec)
+    _shm = [ fshm, xshm ]
+
+def _select(job: tuple):
+    return select(job[0], _F, _X, *job[1:])
+
+
+class Selection:
+
+    # joined instance features (F) and penalized runtimes (X) of the same instances
+    def __init__(self, F: np.ndarray, X: np.ndarray, hashes, features: list[str], solvers: list[str], max_runtime: int, penalty: int = 2):
+        self.F = np.asarray(F, dtype=np.float64, order='F')
+        self.X = np.asarray(X, dtype=np.float64, order='F')
+        self.hashes = pd.Index(hashes, name="hash")
+        self.features = list(features)
+        self.solvers = list(solvers)
+        self.max_runtime = max_runtime
+        self.penalty = penalty
+
+    @staticmethod
+    def from_frame(df: pd.DataFrame, features: list[str], solvers: list[str], max_runtime: int = 5000, penalty: int = 2):
+        # missing features are encoded as -1, missing runs count as unsolved, instances without runs are dropped
+        F = np.nan_to_num(parse(df, features), nan=-1)
+        X = RuntimeMatrix.from_frame(df, solvers, max_runtime, penalty).data
+        keep = ~np.isnan(X).all(axis=1)
+        X = np.nan_to_num(X[keep], nan=penalty * max_runtime)
+        return Selection(F[keep], X, df["hash"].to_numpy()[keep], features, solvers, max_runtime, penalty)
+
+    @staticmethod
+    def from_gbd(gbd, query: str, features: list[str], solvers: list[str], max_runtime: int = 5000, penalty: int = 2, cached: bool = True):
+        # the joined matrix is stored next to the query cache, keyed by the databases, query, columns and penalization
+        qc = cache.default() if cached else None
+        base = qc.key(gbd, query) if qc is not None else None
+        path = None
+        if base is not None:
+            path = os.path.join(qc.directory, "selection", "{}.npz".format(digest([ base, features, solvers, max_runtime, penalty ])))
+            if os.path.exists(path):
+                try:
+                    df = load_columns(path)
+                    return Selection(df[features].to_numpy(), df[solvers].to_numpy(), df["hash"], features, solvers, max_runtime, penalty)
+                except (OSError, ValueError, KeyError):
+                    pass
+        df = DataPreprocessor(gbd, query, features + solvers, cached).get()
+        sel = Selection.from_frame(df, features, solvers, max_runtime, penalty)
+        if path is not None:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                save_columns(sel.frame(), path)
+            except OSError:
+                pass
+        return sel
+
+    def frame(self):
+        df = pd.DataFrame(np.column_stack([ self.F, self.X ]), columns=self.features + self.solvers)
+        df.insert(0, "hash", self.hashes.to_numpy())
+        return df
+
+    def folds(self, k: int = 10, seed: int = 0):
+        parts = np.array_split(np.random.default_rng(seed).permutation(len(self.X)), k)
+        return [ (np.sort(np.concatenate(parts[:f] + parts[f+1:])), np.sort(test)) for f, test in enumerate(parts) ]
+
+    def predict(self, selectors: list[str] = SELECTORS, k: int = 10, seed: int = 0, workers: int = None, params: dict = {}):
+        # cross-validated choice for each instance (from the fold in which it is tested),
+        # all selector and fold combinations are trained in one process pool on the shared matrices
+        folds = self.folds(k, seed)
+        params = { "random_state": seed, **params }
+        jobs = [ (selector, train, test, params) for selector in selectors for train, test in folds ]
+        if workers is None or workers < 2:
+            results = [ select(job[0], self.F, self.X, *job[1:]) for job in jobs ]
+        else:
+            fshm, fspec = share(self.F)
+            xshm, xspec = share(self.X)
+            try:
+                with ProcessPoolExecutor(min(workers, len(jobs)), initializer=_attach, initargs=(fspec, xspec)) as pool:
+                    results = list(pool.map(_select, jobs))
+            finally:
+                for shm in [ fshm, xshm ]:
+                    shm.close()
+                    shm.unlink()
+        choices = { selector: np.empty(len(self.X), dtype=np.intp) for selector in selectors }
+        for (selector, _, test, _), chosen in zip(jobs, results):
+            choices[selector][test] = chosen
+        return choices
+
+    def evaluate(self, selectors: list[str] = SELECTORS, k: int = 10, seed: int = 0, workers: int = None, params: dict = {}):
+        # PAR-k score, solved count and fraction of the SBS-VBS gap closed, one row per selector and for sbs and vbs
+        scores = self.X.mean(axis=0)
+        sbs = scores.min()
+        vbs = self.X.min(axis=1)
+        rows = { "as_{}".format(selector): self.X[np.arange(len(self.X)), choice] for selector, choice in self.predict(selectors, k, seed, workers, params).items() }
+        rows["sbs"] = self.X[:, np.argmin(scores)]
+        rows["vbs"] = vbs
+        tab = pd.DataFrame({ name: [ values.mean(), (values < self.max_runtime).sum() ] for name, values in rows.items() }, index=[ "score", "solved" ]).transpose()
+        tab["solved"] = tab["solved"].astype(int)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tab["gap_closed"] = (sbs - tab["score"]) / (sbs - vbs.mean())
+        return tab
+
+    def report(self, selectors: list[str] = SELECTORS, k: int = 10, seed: int = 0, workers: int = None, params: dict = {}):
+        # the selectors next to the individual solvers, as in scores.scores
+        solvers = pd.DataFrame({ "score": self.X.mean(axis=0), "solved": (self.X < self.max_runtime).sum(axis=0) }, index=self.solvers)
+        tab = pd.concat([ solvers, self.evaluate(selectors, k, seed, workers, params) ])
+        return tab.sort_values(by="score", ascending=True)
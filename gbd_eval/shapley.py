@@ -0,0 +1,143 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from gbd_eval.runtimes import RuntimeMatrix, nanmean, share, attach
+
+# maximum number of cells in one batch (rows x permutations x solvers)
+BATCH_CELLS = 2**24
+
+
+# The value of a portfolio S is its gain over solving nothing: v(S) = worst - mean_i min_{s in S} x_is,
+# with worst the penalized runtime of unsolved instances. Shapley values distribute v(all solvers).
+
+def runtimes(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], max_runtime: int = None, penalty: int = 2):
+    rm = df if isinstance(df, RuntimeMatrix) else RuntimeMatrix.from_frame(df, solvers, max_runtime, penalty)
+    X = rm.columns(solvers)
+    worst = rm.penalty * rm.max_runtime if rm.max_runtime is not None else float(np.nanmax(X))
+    # instances without runs are not part of the track, missing runs of the others count as unsolved
+    X = X[~np.isnan(X).all(axis=1)]
+    return np.asfortranarray(np.fmin(np.nan_to_num(X, nan=worst), worst)), worst
+
+
+def exact(X: np.ndarray, worst: float):
+    # per instance, v is a sum of threshold games: for t in (y_k, y_k+1] of the sorted runtimes y
+    # the k fastest solvers share the gain equally, hence phi_(r) = sum_{k >= r} (y_k+1 - y_k) / k;
+    # leave-one-out: only the fastest solver loses the gap to the second fastest
+    n, m = X.shape
+    phi, loo = np.zeros(m), np.zeros(m)
+    step = max(1, BATCH_CELLS // (4 * m))
+    for b in range(0, n, step):
+        block = X[b:b+step]
+        order = np.argsort(block, axis=1, kind='stable')
+        Y = np.take_along_axis(block, order, axis=1)
+        gaps = np.diff(np.column_stack([ Y, np.full(len(Y), worst) ]), axis=1) / np.arange(1, m + 1)
+        shares = np.cumsum(gaps[:, ::-1], axis=1)[:, ::-1]
+        phi += np.bincount(order.ravel(), weights=shares.ravel(), minlength=m)
+        second = Y[:, 1] if m > 1 else np.full(len(Y), worst)
+        loo += np.bincount(order[:, 0], weights=second - Y[:, 0], minlength=m)
+    return phi / n, loo / n
+
+
+def marginals(X: np.ndarray, worst: float, perms: np.ndarray):
+    # mean marginal contribution of each solver (columns) in each permutation (rows),
+    # the portfolio runtimes along a permutation are a cumulative minimum
+    B, m = perms.shape
+    gains = np.zeros((B, m))
+    step = max(1, BATCH_CELLS // (B * m))
+    for b in range(0, X.shape[0], step):
+        C = np.minimum.accumulate(X[b:b+step][:, perms], axis=2)
+        gains[:, 0] += (worst - C[:, :, 0]).sum(axis=0)
+        gains[:, 1:] += (C[:, :, :-1] - C[:, :, 1:]).sum(axis=0)
+    out = np.empty((B, m))
+    np.put_along_axis(out, perms, gains / X.shape[0], axis=1)
+    return out
+
+
+def batch(X: np.ndarray, worst: float, seed, size: int, antithetic: bool = True):
+    # sum and sum of squares of the per-sample contributions, with antithetic sampling
+    # a sample is the mean over a permutation and its reverse
+    rng = np.random.default_rng(seed)
+    perms = rng.permuted(np.tile(np.arange(X.shape[1]), (size, 1)), axis=1)
+    samples = marginals(X, worst, perms)
+    if antithetic:
+        samples = (samples + marginals(X, worst, perms[:, ::-1])) / 2
+    return samples.sum(axis=0), (samples ** 2).sum(axis=0), size
+
+
+_X = None
+_shm = None
+
+def _attach(spec: tuple):
+    global _X, _shm
+    _shm, _X = attach(spec)
+
+def _batch(job: tuple):
+    return batch(_X, *job)
+
+
+def sample(X: np.ndarray, worst: float, max_permutations: int = 10000, tol: float = None, min_permutations: int = 100, batch_size: int = None,
+           antithetic: bool = True, seed: int = 0, workers: int = None):
+    # permutation sampling until the largest standard error drops below tol (default 0.1% of worst),
+    # batches are seeded by position and folded in order, so results do not depend on the number of workers
+    n, m = X.shape
+    tol = 1e-3 * worst if tol is None else tol
+    size = batch_size or int(np.clip(BATCH_CELLS // (n * m), 1, 1000))
+    seeds = np.random.SeedSequence(seed).spawn(-(-max_permutations // size))
+    total, squares, count = np.zeros(m), np.zeros(m), 0
+    se = np.full(m, np.inf)
+    workers = workers or 1
+    shm, pool = None, None
+    if workers > 1:
+        shm, spec = share(X)
+        pool = ProcessPoolExecutor(workers, initializer=_attach, initargs=(spec,))
+    try:
+        for r in range(0, len(seeds), workers):
+            jobs = [ (worst, s, min(size, max_permutations - i * size), antithetic) for i, s in enumerate(seeds[r:r+workers], r) ]
+            results = pool.map(_batch, jobs) if pool is not None else [ batch(X, *job) for job in jobs ]
+            for s, q, c in results:
+                total, squares, count = total + s, squares + q, count + c
+                if count > 1:
+                    se = np.sqrt(np.maximum(squares / count - (total / count) ** 2, 0) / (count - 1))
+                if count >= min_permutations and se.max() <= tol:
+                    break
+            else:
+                continue
+            break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+            shm.close()
+            shm.unlink()
+    return total / count, se, count
+
+
+def shapley(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], method: str = "exact", max_runtime: int = None, penalty: int = 2, **sampling):
+    # contribution of each solver to the VBS: Shapley value (exact, or sampled with standard error)
+    # and leave-one-out marginal contribution, in PAR-k seconds; the Shapley values sum to score(none) - score(VBS)
+    if method not in [ "exact", "sample" ]:
+        raise ValueError("unknown method '{}'".format(method))
+    rm = df if isinstance(df, RuntimeMatrix) else RuntimeMatrix.from_frame(df, solvers, max_runtime, penalty)
+    X, worst = runtimes(rm, solvers)
+    phi, loo = exact(X, worst)
+    tab = pd.DataFrame({ "score": nanmean(rm.columns(solvers), axis=0), "shapley": phi }, index=solvers)
+    if method == "sample":
+        tab["shapley"], tab["shapley_se"], tab.attrs["permutations"] = sample(X, worst, **sampling)
+    tab["loo"] = loo
+    return tab.sort_values(by="shapley", ascending=False)
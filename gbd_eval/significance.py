@@ -0,0 +1,154 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+from gbd_eval import trace
+from gbd_eval.runtimes import RuntimeMatrix, parse, share, attach
+
+# maximum number of cells in one batch of paired differences
+BATCH_CELLS = 2**20
+
+CORRECTIONS = [ "holm", "bh", "none" ]
+
+
+# Paired comparisons of all solver pairs on the instances both have a result for. Differences are taken row solver
+# minus column solver, such that wins are instances the row solver is faster on. The Wilcoxon signed-rank test drops
+# zero differences and uses the normal approximation with tie correction (as scipy.stats.wilcoxon with method 'approx'),
+# the sign test is exact. A batch of pairs is ranked at once: each column of absolute differences is sorted, and tied
+# runs share their average rank.
+
+def midranks(A: np.ndarray):
+    # ranks (1-based, ties averaged) along the columns of A, and the tie correction sum(t^3 - t) of each column
+    order = np.argsort(A, axis=0, kind='stable')
+    S = np.take_along_axis(A, order, axis=0)
+    n = len(A)
+    pos = np.arange(n)[:, None]
+    new = np.ones(A.shape, dtype=bool)
+    new[1:] = S[1:] != S[:-1]
+    last = np.ones(A.shape, dtype=bool)
+    last[:-1] = new[1:]
+    start = np.maximum.accumulate(np.where(new, pos, 0), axis=0)
+    end = np.flipud(np.minimum.accumulate(np.flipud(np.where(last, pos, n)), axis=0))
+    ranks = np.empty(A.shape)
+    np.put_along_axis(ranks, order, (start + end) / 2 + 1, axis=0)
+    t = (end - start + 1).astype(np.float64)
+    ties = np.where(np.isfinite(S), t * t - 1, 0).sum(axis=0)
+    return ranks, ties
+
+
+def compare(X: np.ndarray, pairs: np.ndarray, tolerance: float = 0):
+    # statistics of the pairs (rows of index pairs) as columns n, wins, losses, ties, delta, w_minus (rank sum of the wins), z
+    step = max(1, BATCH_CELLS // max(1, len(X)))
+    out = np.empty((len(pairs), 7))
+    for b in range(0, len(pairs), step):
+        i, j = pairs[b:b+step, 0], pairs[b:b+step, 1]
+        D = X[:, i] - X[:, j]
+        valid = ~np.isnan(D)
+        tie = valid & (np.abs(D) <= tolerance)
+        wins, losses = (valid & ~tie & (D < 0)).sum(axis=0), (valid & ~tie & (D > 0)).sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.nansum(D, axis=0) / valid.sum(axis=0)
+        # ranks of the absolute non-zero differences, the others sort last
+        ranks, ties = midranks(np.where(valid & ~tie, np.abs(D), np.inf))
+        w_minus = np.where(valid & ~tie & (D < 0), ranks, 0).sum(axis=0)
+        m = wins + losses
+        mean, var = m * (m + 1) / 4, m * (m + 1) * (2 * m + 1) / 24 - ties / 48
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = (w_minus - mean) / np.sqrt(var)
+        out[b:b+step] = np.column_stack([ valid.sum(axis=0), wins, losses, tie.sum(axis=0), delta, w_minus, z ])
+    return out
+
+
+def correct(p: np.ndarray, method: str = "holm"):
+    # adjusted p-values, Holm (family-wise error) or Benjamini-Hochberg (false discovery rate)
+    if method == "none":
+        return p.copy()
+    m = len(p)
+    order = np.argsort(p, kind='stable')
+    q = np.empty(m)
+    if method == "holm":
+        q[order] = np.minimum(1, np.maximum.accumulate((m - np.arange(m)) * p[order]))
+    else:
+        q[order] = np.minimum(1, np.minimum.accumulate((m / np.arange(m, 0, -1) * p[order][::-1]))[::-1])
+    return q
+
+
+_X = None
+_shm = None
+
+def _attach(spec: tuple):
+    global _X, _shm
+    _shm, _X = attach(spec)
+
+def _compare(job: tuple):
+    return compare(_X, *job)
+
+
+@trace.traced("significance.significance")
+def significance(df: pd.DataFrame | RuntimeMatrix, solvers: list[str], tolerance: float = 0, correction: str = "holm", workers: int = None):
+    # one row per pair of solvers (in the given order) with instances compared, wins/losses/ties of the first solver,
+    # its mean difference (delta), the sign and Wilcoxon tests with their p-values adjusted over all pairs (q), and
+    # the matched-pairs rank-biserial correlation (effect, from -1 to 1, positive when the first solver is faster)
+    from scipy.special import ndtr
+    from scipy.stats import binom
+    if correction not in CORRECTIONS:
+        raise ValueError("unknown correction '{}'".format(correction))
+    X = df.columns(solvers) if isinstance(df, RuntimeMatrix) else parse(df, solvers)
+    pairs = np.array(list(combinations(range(len(solvers)), 2)), dtype=np.intp).reshape(-1, 2)
+    trace.current().set(rows=len(X), cols=len(solvers), pairs=len(pairs))
+    if workers is None or workers < 2 or len(pairs) < 2 * workers:
+        stats = compare(X, pairs, tolerance)
+    else:
+        shm, spec = share(X)
+        try:
+            with ProcessPoolExecutor(workers, initializer=_attach, initargs=(spec,)) as pool:
+                stats = np.vstack([ np.empty((0, 7)) ] + list(pool.map(_compare, [ (part, tolerance) for part in np.array_split(pairs, 4 * workers) ])))
+        finally:
+            shm.close()
+            shm.unlink()
+    n, wins, losses, ties, delta, w_minus, z = stats.T
+    m = wins + losses
+    tab = pd.DataFrame({ "solver": [ solvers[i] for i in pairs[:, 0] ], "other": [ solvers[j] for j in pairs[:, 1] ] })
+    tab["n"], tab["wins"], tab["losses"], tab["ties"] = n.astype(np.int64), wins.astype(np.int64), losses.astype(np.int64), ties.astype(np.int64)
+    tab["delta"] = delta
+    tab["sign_p"] = np.minimum(1, 2 * binom.cdf(np.minimum(wins, losses), m, .5))
+    tab["wilcoxon_z"] = z
+    tab["wilcoxon_p"] = np.where(np.isnan(z), 1, 2 * ndtr(-np.abs(z)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tab["effect"] = 4 * w_minus / (m * (m + 1)) - 1
+    tab["sign_q"] = correct(tab["sign_p"].to_numpy(), correction)
+    tab["wilcoxon_q"] = correct(tab["wilcoxon_p"].to_numpy(), correction)
+    return tab
+
+
+def matrix(tab: pd.DataFrame, value: str = "effect", solvers: list[str] = None):
+    # solvers x solvers matrix of a column of significance(), seen from the row solver:
+    # effect, delta and z change sign, wins and losses swap, the other columns are symmetric
+    solvers = solvers or list(dict.fromkeys(tab["solver"].tolist() + tab["other"].tolist()))
+    mirrored = { "wins": "losses", "losses": "wins" }.get(value, value)
+    sign = -1 if value in [ "effect", "delta", "wilcoxon_z" ] else 1
+    mat = pd.DataFrame(np.nan, index=solvers, columns=solvers)
+    index = { s: i for i, s in enumerate(solvers) }
+    keep = tab["solver"].isin(index.keys()) & tab["other"].isin(index.keys())
+    i, j = tab.loc[keep, "solver"].map(index).to_numpy(), tab.loc[keep, "other"].map(index).to_numpy()
+    values = mat.to_numpy()
+    values[i, j] = tab.loc[keep, value].to_numpy()
+    values[j, i] = sign * tab.loc[keep, mirrored].to_numpy()
+    return pd.DataFrame(values, index=solvers, columns=solvers)
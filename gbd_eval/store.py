@@ -0,0 +1,227 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: python -m gbd_eval.store gen/store append --year 2023 --track main --meta data/meta.db data/sc2023/results_main_detailed.csv
+
+import os
+import re
+import json
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+
+from gbd_eval import trace
+from gbd_eval.cache import digest, save_columns, load_columns
+from gbd_eval.runtimes import parse
+
+# rows per row group, and the maximum number of distinct values of a feature kept as row group statistics
+ROW_GROUP_SIZE = 2**16
+MAX_DISTINCT = 64
+
+
+# A store is a directory of partitions year=<year>/track=<track>/solvers=<digest of the solver set>, each a sequence of
+# row groups (columnar npz files, rows sorted by hash). The manifest keeps per row group the hash range and the distinct
+# values of each feature, such that filters on year, track, hash and features skip partitions and row groups unread,
+# and only the requested columns of the remaining row groups are loaded.
+
+def clauses(query: str):
+    # conjunctions of 'name = value' and 'name != value', as (name, op, value) filters
+    where = []
+    for clause in re.split(r"\s+and\s+", query.strip()) if query and query.strip() else []:
+        match = re.fullmatch(r"\s*(\w+)\s*(!=|=)\s*(\"[^\"]*\"|'[^']*'|[^\s'\"]+)\s*", clause)
+        if match is None:
+            raise ValueError("unsupported store query '{}'".format(clause))
+        name, op, value = match.groups()
+        where.append((name, op, value.strip("'\"")))
+    return where
+
+
+def accepts(values: list, op: str, value):
+    # whether a row group with these distinct values (None: unknown) can contain matching rows
+    if values is None:
+        return True
+    if op == "=":
+        return value in values
+    if op == "!=":
+        return values != [ value ]
+    return len(set(values) & set(value)) > 0
+
+
+class Store:
+
+    def __init__(self, root: str):
+        self.root = root
+        self.path = os.path.join(root, "manifest.json")
+        self.partitions = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.partitions = json.load(f)["partitions"]
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({ "partitions": self.partitions }, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def solvers(self):
+        return list(dict.fromkeys(s for part in self.partitions.values() for s in part["solvers"]))
+
+    def features(self):
+        return list(dict.fromkeys(f for part in self.partitions.values() for f in part["features"]))
+
+    def append(self, df: pd.DataFrame, year, track: str, solvers: list[str] = None, features: list[str] = [], row_group_size: int = ROW_GROUP_SIZE):
+        # runtimes are stored as float64 (non-numeric values as NaN), features as given
+        solvers = solvers or [ c for c in df.columns if c != "hash" and c not in features ]
+        name = "year={}/track={}/solvers={}".format(year, track, digest(sorted(solvers))[:12])
+        part = self.partitions.setdefault(name, { "year": str(year), "track": track, "solvers": list(solvers), "features": list(features), "groups": [] })
+        if part["features"] != list(features):
+            raise ValueError("partition {} has features {}, got {}".format(name, part["features"], features))
+        with trace.span("store.append", partition=name).shape(df):
+            df = df.sort_values("hash", kind='stable')
+            data = pd.DataFrame(parse(df, part["solvers"]), columns=part["solvers"])
+            data.insert(0, "hash", df["hash"].astype(str).to_numpy())
+            for feature in features:
+                data[feature] = df[feature].to_numpy()
+            # appending the same rows twice would duplicate them in every query
+            source = hashlib.sha1(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes()).hexdigest()
+            if source in part.setdefault("sources", []):
+                raise ValueError("these results were already appended to partition {}".format(name))
+            part["sources"].append(source)
+            os.makedirs(os.path.join(self.root, name), exist_ok=True)
+            for start in range(0, len(data.index), row_group_size):
+                group = data.iloc[start:start+row_group_size]
+                file = "part-{:05d}.npz".format(len(part["groups"]))
+                save_columns(group, os.path.join(self.root, name, file))
+                stats = { feature: group[feature].dropna().unique().tolist() for feature in features }
+                part["groups"].append({ "file": file, "rows": len(group.index), "hash_min": group["hash"].iloc[0], "hash_max": group["hash"].iloc[-1],
+                                        "values": { f: sorted(map(str, v)) if len(v) <= MAX_DISTINCT else None for f, v in stats.items() } })
+        self.save()
+        return self
+
+    def scan(self, solvers: list[str] = None, features: list[str] = [], where: list[tuple] = [], hashes: list[str] = None):
+        # rows of all partitions and row groups passing the filters (name, op, value) with op '=', '!=' or 'in',
+        # with columns year, track, hash, features and the requested solvers (NaN where a partition lacks one, all for None),
+        # partitions without any of the requested solvers are skipped unless only features are requested (solvers=[])
+        where = list(where) + ([ ("hash", "in", list(hashes)) ] if hashes is not None else [])
+        for _, op, _ in where:
+            if op not in [ "=", "!=", "in" ]:
+                raise ValueError("unknown operator '{}'".format(op))
+        frames = []
+        with trace.span("store.scan") as span:
+            read, skipped = 0, 0
+            for name, part in self.partitions.items():
+                keys = { "year": part["year"], "track": part["track"] }
+                if not all(accepts([ keys[col] ], op, value) for col, op, value in where if col in keys):
+                    skipped += len(part["groups"])
+                    continue
+                cols = [ s for s in (part["solvers"] if solvers is None else solvers) if s in part["solvers"] ]
+                if solvers and not cols:
+                    skipped += len(part["groups"])
+                    continue
+                if any(col not in keys and col != "hash" and col not in part["features"] for col, _, _ in where):
+                    skipped += len(part["groups"])
+                    continue
+                needed = [ f for f in dict.fromkeys(list(features) + [ col for col, _, _ in where if col in part["features"] ]) if f in part["features"] ]
+                for group in part["groups"]:
+                    if not self.matches(group, where):
+                        skipped += 1
+                        continue
+                    df = load_columns(os.path.join(self.root, name, group["file"]), [ "hash" ] + needed + cols)
+                    df = df[self.mask(df, where)]
+                    df.insert(0, "track", part["track"])
+                    df.insert(0, "year", part["year"])
+                    frames.append(df)
+                    read += 1
+            columns = [ "year", "track", "hash" ] + [ f for f in features ] + (solvers if solvers is not None else self.solvers())
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+            df = df.reindex(columns=columns)
+            span.set(groups_read=read, groups_skipped=skipped).shape(df)
+        return df
+
+    def matches(self, group: dict, where: list[tuple]):
+        for name, op, value in where:
+            if name == "hash":
+                lo, hi = group["hash_min"], group["hash_max"]
+                if op == "=" and not lo <= value <= hi:
+                    return False
+                if op == "in":
+                    candidates = np.sort(np.asarray(value, dtype=str))
+                    if np.searchsorted(candidates, hi, side='right') == np.searchsorted(candidates, lo, side='left'):
+                        return False
+            elif name in group["values"] and not accepts(group["values"][name], op, value):
+                return False
+        return True
+
+    def mask(self, df: pd.DataFrame, where: list[tuple]):
+        keep = np.ones(len(df.index), dtype=bool)
+        for name, op, value in where:
+            if name in df.columns:
+                values = df[name].astype(str)
+                if op == "=":
+                    keep &= (values == value).to_numpy()
+                elif op == "!=":
+                    keep &= (values != value).to_numpy()
+                else:
+                    keep &= values.isin(value).to_numpy()
+        return keep
+
+    def select(self, years: list = None, tracks: list[str] = None, families: list[str] = None, hashes: list[str] = None,
+               solvers: list[str] = None, features: list[str] = []):
+        where = [ (name, "in", [ str(v) for v in values ]) for name, values in [ ("year", years), ("track", tracks), ("family", families) ] if values is not None ]
+        return self.scan(solvers, list(dict.fromkeys(features + ([ "family" ] if families is not None else []))), where, hashes)
+
+    def query(self, query: str = "", resolve: list[str] = []):
+        # the part of GBD's interface used by DataPreprocessor: one row per matching (year, track, hash),
+        # with columns hash and the resolved features, solvers, year or track
+        resolve = [ r for r in resolve if r != "hash" ]
+        solvers = [ r for r in resolve if r in self.solvers() ]
+        features = [ r for r in resolve if r in self.features() ]
+        unknown = [ r for r in resolve if r not in solvers and r not in features and r not in [ "year", "track" ] ]
+        if unknown:
+            raise ValueError("unknown features {}".format(unknown))
+        df = self.scan(solvers, features, clauses(query))
+        return df[[ "hash" ] + resolve]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append competition results to a gbd_eval store, or list its partitions")
+    parser.add_argument("root", help="store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    cmd = commands.add_parser("append", help="append a result CSV (hash column and one column per solver)")
+    cmd.add_argument("csv")
+    cmd.add_argument("--year", required=True)
+    cmd.add_argument("--track", required=True)
+    cmd.add_argument("--meta", help="GBD database to take instance features from")
+    cmd.add_argument("--features", nargs="*", default=[ "family" ], help="instance features stored with the runtimes")
+    commands.add_parser("info", help="list partitions")
+    args = parser.parse_args()
+    store = Store(args.root)
+    if args.command == "append":
+        from gbd_eval.tracks import read_results
+        df, solvers = read_results(args.csv)
+        df = df.reset_index()
+        features = args.features if args.meta else []
+        if args.meta:
+            from gbd_core.api import GBD
+            from gbd_eval import cache
+            meta = cache.query(GBD([ args.meta ]), "", features).drop_duplicates("hash")
+            df = df.merge(meta, on="hash", how="left")
+        store.append(df, args.year, args.track, solvers, features)
+    for name, part in sorted(store.partitions.items()):
+        print("{}  {} solvers  {} rows in {} groups".format(name, len(part["solvers"]), sum(g["rows"] for g in part["groups"]), len(part["groups"])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./bench.py
+
+import numpy as np
+import pandas as pd
+
+from gbd_eval.runtimes import RuntimeMatrix
+
+
+def hashes(rng: np.random.Generator, n: int):
+    hi, lo = rng.integers(0, 2**63, n), rng.integers(0, 2**63, n)
+    return np.char.add(np.char.mod("%016x", hi), np.char.mod("%016x", lo)).astype(object)
+
+
+def families(rng: np.random.Generator, n: int, n_families: int):
+    # zipf-like family sizes, as in competition benchmark sets
+    p = 1 / np.arange(1, n_families + 1)
+    return rng.choice(n_families, n, p=p / p.sum())
+
+
+def log_runtimes(rng: np.random.Generator, fam: np.ndarray, m: int, n_families: int, n_groups: int):
+    # log runtime = instance hardness + family affinity of the solver's group + solver speed + heavy-tailed noise,
+    # solvers of one group (variants of the same solver) are strongly correlated
+    n = len(fam)
+    hardness = rng.normal(0, 1.5, n) + rng.normal(0, 1, n_families)[fam]
+    group = rng.integers(0, n_groups, m)
+    affinity = rng.normal(0, .7, (n_groups, n_families))
+    speed = rng.normal(0, .3, m)
+    X = np.empty((n, m), order='F')
+    for j in range(m):
+        X[:, j] = hardness + affinity[group[j], fam] + speed[j] + .5 * rng.standard_t(3, n)
+    return X
+
+
+def frame(n: int = 1000, m: int = 10, timeout: int = 5000, timeout_rate: float = .3, n_families: int = None, n_groups: int = None, penalty: int = 2, seed: int = 0):
+    # wide runtime table like the SC2023 results: hash, one column per solver (timeouts as penalty * timeout), family
+    rng = np.random.default_rng(seed)
+    n_families = n_families or max(1, min(100, n // 20))
+    n_groups = n_groups or max(1, m // 5)
+    fam = families(rng, n, n_families)
+    X = log_runtimes(rng, fam, m, n_families, n_groups)
+    # calibrate the scale such that a fraction of timeout_rate runs times out
+    sample = X.ravel(order='F')[rng.integers(0, X.size, min(X.size, 2**20))]
+    shift = np.quantile(sample, 1 - timeout_rate) - np.log(timeout)
+    for j in range(m):
+        col = np.exp(X[:, j] - shift)
+        np.clip(col, .01, None, out=col)
+        col[col >= timeout] = penalty * timeout
+        X[:, j] = col
+    solvers = [ "solver{}".format(j) for j in range(m) ]
+    df = pd.DataFrame(X, columns=solvers)
+    df.insert(0, "hash", hashes(rng, n))
+    df["family"] = np.char.add("family", fam.astype(str)).astype(object)
+    return df, solvers
+
+
+def matrix(n: int = 1000, m: int = 10, timeout: int = 5000, timeout_rate: float = .3, penalty: int = 2, seed: int = 0):
+    df, solvers = frame(n, m, timeout, timeout_rate, penalty=penalty, seed=seed)
+    return RuntimeMatrix.from_frame(df, solvers, timeout, penalty)
+
+
+def long(df: pd.DataFrame, solvers: list[str], timeout: int = 5000, duplicates: float = .1, seed: int = 0):
+    # long format records (hash, solver, runtime, status) with a fraction of repeated runs
+    rng = np.random.default_rng(seed)
+    values = df[solvers].to_numpy().ravel(order='F')
+    rows = np.tile(np.arange(len(df.index)), len(solvers))
+    cols = np.repeat(np.arange(len(solvers)), len(df.index))
+    extra = rng.integers(0, len(values), int(duplicates * len(values)))
+    order = np.concatenate([ np.arange(len(values)), extra ])
+    runtime = values[order] * rng.uniform(.9, 1.1, len(order))
+    solved = runtime < timeout
+    return pd.DataFrame({
+        "hash": df["hash"].to_numpy()[rows[order]],
+        "solver": np.asarray(solvers, dtype=object)[cols[order]],
+        "runtime": np.where(solved, runtime, timeout),
+        "status": np.where(solved, "solved", "timeout"),
+    })
@@ -14,6 +14,7 @@
 
 # run: ./eval.py
 
+import numpy as np
 import pandas as pd
 
 from gbd_eval.util import name, number
@@ -52,3 +53,25 @@ def best_k_portfolios(df: pd.DataFrame, to_latex: str):
     s = s.format_index(name, axis=1)
     s.to_latex(to_latex, hrules=True, clines="all;data", column_format="l|p{.9\linewidth}|r")
     return df
+
+
+def schedule(df: pd.DataFrame, to_latex: str):
+    s = df.style.format(precision=2, subset=["start", "slice", "score"])
+    s.hide(axis="index")
+    s = s.format(name, subset=["solver"])
+    s = s.format_index(name, axis=1)
+    s.to_latex(to_latex, hrules=True, clines="all;data", column_format="r|l|rr|rr")
+    return df
+
+
+def significance(df: pd.DataFrame, q: pd.DataFrame = None, to_latex: str = None, to_html: str = None, alpha: float = 0.05):
+    # a solvers x solvers matrix (significance.matrix), cells with adjusted p-values q below alpha in bold
+    s = df.style.format(precision=2, na_rep="")
+    s = s.format_index(name, axis=0).format_index(name, axis=1)
+    if q is not None:
+        s = s.apply(lambda _ : np.where(q.reindex(index=df.index, columns=df.columns).to_numpy() < alpha, "font-weight: bold;", ""), axis=None)
+    if to_html is not None:
+        s.to_html(to_html)
+    if to_latex is not None:
+        s.to_latex(to_latex, hrules=True, convert_css=True, column_format="l|" + "r" * df.shape[1])
+    return df
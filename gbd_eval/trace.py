@@ -0,0 +1,226 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: GBD_EVAL_TRACE=trace.jsonl ./eval.py && python -m gbd_eval.trace trace.jsonl --chrome trace.json
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import argparse
+import functools
+import threading
+import itertools
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# GBD_EVAL_TRACE=<file> appends one JSON line per finished span (all processes write to the same file),
+# GBD_EVAL_PROFILE=<directory> stores a cProfile dump for each span matching GBD_EVAL_PROFILE_SPANS (glob, default '*')
+TRACE = os.environ.get("GBD_EVAL_TRACE")
+PROFILE = os.environ.get("GBD_EVAL_PROFILE")
+PROFILE_SPANS = os.environ.get("GBD_EVAL_PROFILE_SPANS", "*")
+
+
+def configure(output: str = None, profile: str = None, spans: str = "*"):
+    # also exported to the environment, such that worker processes trace as well
+    global TRACE, PROFILE, PROFILE_SPANS
+    TRACE, PROFILE, PROFILE_SPANS = output, profile, spans
+    for var, value in [ ("GBD_EVAL_TRACE", output), ("GBD_EVAL_PROFILE", profile), ("GBD_EVAL_PROFILE_SPANS", spans) ]:
+        if value is None:
+            os.environ.pop(var, None)
+        else:
+            os.environ[var] = value
+
+
+def enabled():
+    return TRACE is not None or PROFILE is not None
+
+
+def max_rss():
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def shape(obj):
+    # rows and columns of data frames, runtime matrices and arrays
+    data = getattr(obj, "data", obj)
+    if hasattr(data, "shape") and len(data.shape) == 2:
+        return { "rows": int(data.shape[0]), "cols": int(data.shape[1]) }
+    return {}
+
+
+_local = threading.local()
+_ids = itertools.count()
+_profiling = False
+
+
+class Span:
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def shape(self, obj):
+        return self.set(**shape(obj))
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault("stack", [])
+        self.parent = stack[-1].id if stack else None
+        self.depth = len(stack)
+        self.id = "{}-{}".format(os.getpid(), next(_ids))
+        stack.append(self)
+        self.profiler = self.start_profile()
+        self.rss = max_rss()
+        self.start = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall, cpu = time.perf_counter() - self.wall, time.process_time() - self.cpu
+        rss = max_rss()
+        self.stop_profile()
+        _local.stack.pop()
+        record = { "name": self.name, "id": self.id, "parent": self.parent, "depth": self.depth, "pid": os.getpid(), "tid": threading.get_ident(),
+                   "start": self.start, "wall": wall, "cpu": cpu, "rss_delta": rss - self.rss, "rss_peak": rss }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record.update(self.attrs)
+        if TRACE is not None:
+            write(record)
+        return False
+
+    def start_profile(self):
+        # cProfile cannot nest, the outermost matching span is profiled
+        global _profiling
+        if PROFILE is None or _profiling or not fnmatch.fnmatch(self.name, PROFILE_SPANS):
+            return None
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        _profiling = True
+        return profiler
+
+    def stop_profile(self):
+        global _profiling
+        if self.profiler is not None:
+            self.profiler.disable()
+            _profiling = False
+            os.makedirs(PROFILE, exist_ok=True)
+            self.profiler.dump_stats(os.path.join(PROFILE, "{}.{}.prof".format("".join(c if c.isalnum() or c in "-_." else "_" for c in self.name), self.id)))
+
+
+class NoSpan:
+
+    def set(self, **attrs):
+        return self
+
+    def shape(self, obj):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_nospan = NoSpan()
+
+
+def current():
+    # innermost open span of this thread, e.g. to attach sizes from inside a traced function
+    stack = _local.__dict__.get("stack")
+    return stack[-1] if stack else _nospan
+
+
+def span(name: str, **attrs):
+    # with span("portfolio.generate", k=5) as s: ... s.shape(df)
+    return Span(name, attrs) if enabled() else _nospan
+
+
+def traced(name: str = None):
+    def decorator(func):
+        label = name or "{}.{}".format(func.__module__.rsplit(".", 1)[-1], func.__qualname__)
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write(record: dict):
+    # one short append per span, such that concurrent processes do not interleave lines
+    with open(TRACE, "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+def read(path: str):
+    with open(path) as f:
+        return [ json.loads(line) for line in f if line.strip() ]
+
+
+def to_chrome(records: list[dict], path: str):
+    # complete events ("ph": "X") for chrome://tracing and ui.perfetto.dev
+    events = []
+    for r in records:
+        args = { k: v for k, v in r.items() if k not in [ "name", "pid", "tid", "start", "wall" ] }
+        events.append({ "name": r["name"], "ph": "X", "ts": r["start"] * 1e6, "dur": r["wall"] * 1e6, "pid": r["pid"], "tid": r["tid"], "args": args })
+    with open(path, "w") as f:
+        json.dump({ "traceEvents": events, "displayTimeUnit": "ms" }, f)
+
+
+def summary(records: list[dict]):
+    # per span name: count, wall and cpu time (total), largest rss growth, self time excludes child spans
+    children = defaultdict(float)
+    for r in records:
+        if r["parent"] is not None:
+            children[r["parent"]] += r["wall"]
+    stats = defaultdict(lambda: [ 0, 0.0, 0.0, 0.0, 0 ])
+    for r in records:
+        s = stats[r["name"]]
+        s[0] += 1
+        s[1] += r["wall"]
+        s[2] += r["wall"] - children[r["id"]]
+        s[3] += r["cpu"]
+        s[4] = max(s[4], r["rss_delta"])
+    print("{:<48} {:>6} {:>10} {:>10} {:>10} {:>10}".format("span", "count", "wall", "self", "cpu", "rss+ MB"))
+    for name, (count, wall, own, cpu, rss) in sorted(stats.items(), key=lambda item : -item[1][2]):
+        print("{:<48} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.1f}".format(name, count, wall, own, cpu, rss / 2**20))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize or convert gbd_eval traces")
+    parser.add_argument("trace", help="JSON lines written with GBD_EVAL_TRACE")
+    parser.add_argument("--chrome", help="write a Chrome trace file")
+    args = parser.parse_args()
+    records = read(args.trace)
+    summary(records)
+    if args.chrome:
+        to_chrome(records, args.chrome)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# MIT License
+#
+# © 2023 Markus Iser, University of Helsinki
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# run: ./eval.py
+
+import re
+import csv
+import numpy as np
+import pandas as pd
+
+from gbd_eval import cache, runtimes
+
+
+def sanitize(name: str):
+    # feature names as GBD derives them from CSV headers
+    return re.sub("[^0-9a-zA-Z]+", "_", name)
+
+
+def delimiter(path: str):
+    with open(path) as f:
+        return csv.Sniffer().sniff(f.readline() + "\n" + f.readline(), delimiters=";, \t").delimiter
+
+
+def solvers_of(path: str, exclude: list[str] = [ "hash", "aresult", "vresult" ]):
+    header = pd.read_csv(path, sep=delimiter(path), nrows=0).columns
+    return [ s for s in map(sanitize, header) if s not in exclude ]
+
+
+def read_results(path: str, exclude: list[str] = [ "hash", "aresult", "vresult" ]):
+    df = pd.read_csv(path, sep=delimiter(path), dtype={ "hash": str }, float_precision="round_trip")
+    df.columns = [ sanitize(c) for c in df.columns ]
+    solvers = [ s for s in df.columns if s not in exclude ]
+    return df.drop_duplicates("hash", keep="last").set_index("hash")[solvers], solvers
+
+
+class Tracks:
+
+    # runtimes of all tracks in one frame indexed by (track, hash), rows of a track are contiguous,
+    # solvers that did not run in a track are NaN there
+    def __init__(self, frame: pd.DataFrame, solvers: dict, timeouts: dict, features: list[str] = [], penalty: int = 2):
+        self.frame = frame
+        self.solvers = solvers
+        self.timeouts = timeouts
+        self.features = features
+        self.penalty = penalty
+        self.columns = list(dict.fromkeys(s for track in solvers.values() for s in track))
+
+    @staticmethod
+    def read(gbd, query: str, path: str, features: list[str] = [ "family" ]):
+        # the frame of one track as returned by a GBD query: hash, the solvers of the result file and the features
+        meta = cache.query(gbd, query, features).drop_duplicates("hash").set_index("hash")
+        df = read_results(path)[0].reindex(meta.index)
+        df[features] = meta[features]
+        return df.reset_index()
+
+    @staticmethod
+    def from_tracks(frames: dict, timeouts: dict, features: list[str] = [ "family" ], penalty: int = 2):
+        # track frames (as from read) in one frame
+        solvers = { track: [ c for c in df.columns if c not in [ "hash" ] + features ] for track, df in frames.items() }
+        frame = pd.concat([ df.set_index("hash") for df in frames.values() ], keys=list(frames.keys()), names=[ "track", "hash" ])
+        return Tracks(frame, solvers, timeouts, features, penalty)
+
+    @staticmethod
+    def load(gbd, query: str, files: dict, timeouts: dict, features: list[str] = [ "family" ], penalty: int = 2):
+        # every result file is read once, the instances and their meta features come from the (cached) query
+        return Tracks.from_tracks({ track: Tracks.read(gbd, query, path, features) for track, path in files.items() }, timeouts, features, penalty)
+
+    def bounds(self):
+        # row range of each track
+        sizes = self.frame.index.get_level_values("track").value_counts(sort=False).reindex(list(self.solvers))
+        ends = np.cumsum(sizes.to_numpy())
+        return dict(zip(self.solvers, zip(ends - sizes.to_numpy(), ends)))
+
+    def track(self, track: str):
+        # the frame of one track as returned by a GBD query: hash, its solvers and the features
+        df = self.frame.loc[track, self.solvers[track] + self.features].reset_index()
+        return df
+
+    def penalized(self):
+        # runtimes of all tracks, each penalized with its own timeout
+        X = runtimes.parse(self.frame, self.columns)
+        limit = np.empty(len(X))
+        for track, (start, end) in self.bounds().items():
+            limit[start:end] = self.timeouts[track]
+        limit = limit[:, None]
+        hit = (X >= limit) | (X < 0)
+        X[hit] = np.broadcast_to(self.penalty * limit, X.shape)[hit]
+        return X
+
+    def scores(self):
+        # score (mean penalized runtime) and solved count per track and solver, including the VBS of each track,
+        # from segment reductions over the contiguous track rows
+        X = self.penalized()
+        X = np.column_stack([ X, np.fmin.reduce(X, axis=1) ])
+        bounds = self.bounds()
+        starts = np.array([ start for start, _ in bounds.values() ])
+        limit = np.array([ self.penalty * self.timeouts[track] for track in bounds ])
+        valid = ~np.isnan(X)
+        sums = np.add.reduceat(np.where(valid, X, 0), starts, axis=0)
+        nums = np.add.reduceat(valid, starts, axis=0)
+        codes = np.repeat(np.arange(len(bounds)), [ end - start for start, end in bounds.values() ])
+        solved = np.add.reduceat(X < limit[codes][:, None], starts, axis=0)
+        tab = []
+        for t, track in enumerate(bounds):
+            cols = [ self.columns.index(s) for s in self.solvers[track] ] + [ len(self.columns) ]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                score = sums[t, cols] / nums[t, cols]
+            tab.append(pd.DataFrame({ "score": score, "solved": solved[t, cols] }, index=pd.MultiIndex.from_product([ [ track ], self.solvers[track] + [ "vbs" ] ], names=[ "track", "solver" ])))
+        return pd.concat(tab)
+
+    def scores_table(self, track: str, scores: pd.DataFrame = None):
+        scores = self.scores() if scores is None else scores
+        return scores.loc[track].rename_axis(None).sort_values(by="score", ascending=True)
+
+    def overall(self, tracks: list[str], subs: list[str]):
+        # score tables of several tracks side by side (solvers in all of them), sorted by the first,
+        # columns of the following tracks are suffixed with their sub name
+        scores = self.scores()
+        parts = [ self.scores_table(track, scores).add_suffix("" if i == 0 else "_{}".format(sub)) for i, (track, sub) in enumerate(zip(tracks, subs)) ]
+        tab = pd.concat(parts, axis=1, join="inner")
+        return tab.loc[parts[0].index.intersection(tab.index, sort=False)]
@@ -3,6 +3,18 @@ import sys
 sc2023dict = {
     "vbs": "VBS",
     "count": "\#",
+    "ci_low": "CI low",
+    "ci_high": "CI high",
+    "p_rank": "P(rank)",
+    "shapley": "Shapley",
+    "shapley_se": "SE",
+    "loo": "LOO",
+    "sbs": "SBS",
+    "gap_closed": "Gap closed",
+    "slot": "\\#",
+    "as_classification": "AS (classification)",
+    "as_regression": "AS (pairwise regression)",
+    "as_cost": "AS (cost-sensitive)",
     # Solvers in Main Track:
     "AMSAT_": "AMSAT",
     "CaDiCaL_vivinst": "Cadical vivinst",